@@ -1,13 +1,246 @@
+import time
+# time-to-interactive is measured from here
+STARTED = time.perf_counter()
 import typer
 import asyncio
-from .tui import TerminalTUI
+import json
+from functools import partial
+# textual, the agent and docker are imported by the commands that need them
+from .llmBackend import LLM_BACKENDS, make_backend
+from .llmCache import LLMCache, LLM_CACHE_MODES
+from .tracing import tracer
+from .logConfig import setup_logging, parse_module_levels
 
 app = typer.Typer()
 
-@app.command()
-def main():
-    app = TerminalTUI()
-    app.run()
+@app.callback(invoke_without_command=True)
+def main(
+    ctx: typer.Context,
+    refresh_tools: bool = typer.Option(False, "--refresh-tools", help="Ignore the cached MCP tool catalog and fetch it again."),
+    planner: str = typer.Option("two_phase", "--planner", help="Tool planning mode: 'two_phase' or 'fused' (one round trip)."),
+    pool_size: int = typer.Option(0, "--pool-size", help="Keep this many warm sandboxes and lease one instead of using the shared container."),
+    llm_cache: str = typer.Option("off", "--llm-cache", help="Model response cache: 'off', 'cache', 'record' or 'replay' (no network)."),
+    llm_cache_dir: str = typer.Option(None, "--llm-cache-dir", help="Directory for cached model responses."),
+    tool_top_k: int = typer.Option(8, "--tool-top-k", help="Number of most relevant MCP tools offered per step (0 = all)."),
+    backend: str = typer.Option("groq", "--backend", help="LLM backend: 'groq' or 'openai' (any OpenAI-compatible endpoint)."),
+    base_url: str = typer.Option(None, "--base-url", help="Base URL of the OpenAI-compatible endpoint, e.g. http://localhost:8000/v1."),
+    model: str = typer.Option(None, "--model", help="Model name (defaults to the backend's default model)."),
+    resume: str = typer.Option(None, "--resume", help="Resume a saved session (conversation and sandbox); type '/save [name]' in the UI to save one."),
+    session_mode: str = typer.Option("image", "--session-mode", help="How '/save' captures the sandbox: 'image' (docker commit) or 'tarball' (workspace + pip freeze)."),
+    run_cache: bool = typer.Option(False, "--run-cache", help="Reuse run_python_file results when script, workspace and packages are unchanged."),
+    cpus: float = typer.Option(0.0, "--cpus", help="CPU quota per sandbox, capped at the host's CPU count (0 = unlimited)."),
+    memory: str = typer.Option("", "--memory", help="Memory limit per sandbox, e.g. '512m' or '2g' (empty = unlimited)."),
+    pids: int = typer.Option(0, "--pids", help="Process limit per sandbox (0 = unlimited)."),
+    max_execs: int = typer.Option(0, "--max-execs", help="Script runs and pip installs allowed at once on this host, across all agent processes (0 = CPU count)."),
+    trace: str = typer.Option(None, "--trace", help="Append tracing spans to this JSONL file (F2 shows live stats)."),
+    log_file: str = typer.Option("agent_debug.log", "--log-file", help="Debug log file, rotated by size (empty string disables it)."),
+    log_level: str = typer.Option("DEBUG", "--log-level", help="Log level for the terminal_agent package."),
+    log_modules: str = typer.Option(None, "--log-modules", help="Per-module levels, e.g. 'mcpClient=INFO,agent=DEBUG'."),
+    log_max_chars: int = typer.Option(2000, "--log-max-chars", help="Longer log messages are truncated (0 = never)."),
+    log_sample: int = typer.Option(1, "--log-sample", help="Keep only every Nth oversized debug message."),
+):
+    try:
+        setup_logging(
+            path=log_file,
+            level=log_level,
+            module_levels=parse_module_levels(log_modules),
+            max_chars=log_max_chars,
+            sample_every=log_sample
+        )
+    except ValueError as e:
+        raise typer.BadParameter(str(e), param_hint="--log-level/--log-modules")
+    if ctx.invoked_subcommand is not None:
+        return
+    from .agent import PLANNER_MODES
+    if planner not in PLANNER_MODES:
+        raise typer.BadParameter(f"must be one of {', '.join(PLANNER_MODES)}", param_hint="--planner")
+    if llm_cache not in LLM_CACHE_MODES:
+        raise typer.BadParameter(f"must be one of {', '.join(LLM_CACHE_MODES)}", param_hint="--llm-cache")
+    if backend not in LLM_BACKENDS:
+        raise typer.BadParameter(f"must be one of {', '.join(LLM_BACKENDS)}", param_hint="--backend")
+    if backend == "openai" and not base_url:
+        raise typer.BadParameter("is required with --backend openai", param_hint="--base-url")
+    from .session import SESSION_MODES, load_session
+    if session_mode not in SESSION_MODES:
+        raise typer.BadParameter(f"must be one of {', '.join(SESSION_MODES)}", param_hint="--session-mode")
+    session = None
+    if resume:
+        try:
+            session = load_session(resume)
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint="--resume")
+    if trace:
+        tracer.configure(export_path=trace)
+    from .tui import TerminalTUI
+    from .runCache import RunCache
+    from .dockerClient import resource_limits
+    from .execScheduler import scheduler
+    scheduler.configure(max_execs)
+    # the LLM client is built in the background with the sandbox and the tool catalog
+    app = TerminalTUI(
+        refresh_tools=refresh_tools,
+        planner_mode=planner,
+        pool_size=pool_size,
+        llm_cache=LLMCache(mode=llm_cache, path=llm_cache_dir),
+        tool_top_k=tool_top_k,
+        backend_factory=partial(make_backend, backend, base_url=base_url),
+        model=model,
+        started_at=STARTED,
+        session=session,
+        session_mode=session_mode,
+        run_cache=RunCache() if run_cache else None,
+        limits=resource_limits(cpus=cpus, memory=memory, pids=pids)
+    )
+    try:
+        app.run()
+    finally:
+        tracer.close()
+
+@app.command("sessions")
+def sessions(
+    delete: str = typer.Option(None, "--delete", help="Delete this saved session (and its image)."),
+):
+    """List saved sessions."""
+    from .session import list_sessions, delete_session
+    if delete:
+        try:
+            delete_session(delete)
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint="--delete")
+        typer.echo(f"Deleted session {delete}")
+        return
+    for meta in list_sessions():
+        saved_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(meta["saved_at"]))
+        typer.echo(f"{meta['name']}\t{saved_at}\t{meta['mode']}\t{meta['messages']} messages")
+
+@app.command("serve-llm")
+def serve_llm(
+    host: str = typer.Option("127.0.0.1", "--host", help="Address to listen on."),
+    port: int = typer.Option(8000, "--port", help="Port to listen on."),
+    script: str = typer.Option(None, "--script", help="JSON or JSONL file of scripted replies."),
+    latency: float = typer.Option(0.0, "--latency", help="Seconds before the first byte of every reply."),
+    token_delay: float = typer.Option(0.0, "--token-delay", help="Seconds between streamed chunks."),
+):
+    """Run the offline stand-in LLM server (OpenAI-compatible)."""
+    from .localLLMServer import LocalLLMServer, load_script
+    server = LocalLLMServer(
+        script=load_script(script) if script else None,
+        latency=latency,
+        token_delay=token_delay,
+        host=host,
+        port=port
+    )
+    typer.echo(f"Stand-in LLM server on {server.base_url} (use --backend openai --base-url {server.base_url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+@app.command("bench")
+def bench(
+    tasks: str = typer.Option(None, "--tasks", help="JSON or JSONL task corpus (defaults to the built-in corpus)."),
+    out: str = typer.Option("bench_results.json", "--out", help="Where to write the JSON report."),
+    baseline: str = typer.Option(None, "--baseline", help="Earlier report to compare against; regressions exit with status 1."),
+    tolerance: float = typer.Option(0.2, "--tolerance", help="Allowed relative slowdown before a metric counts as a regression."),
+    planner: str = typer.Option("fused", "--planner", help="Tool planning mode: 'two_phase' or 'fused'."),
+    repeat: int = typer.Option(3, "--repeat", help="Runs of the whole corpus."),
+    llm_latency: float = typer.Option(0.0, "--llm-latency", help="Fake backend seconds before each reply."),
+    token_delay: float = typer.Option(0.0, "--token-delay", help="Fake backend seconds between streamed chunks."),
+    real_docker: bool = typer.Option(False, "--real-docker", help="Run tools in a local Docker container instead of the fake one."),
+):
+    """Benchmark the agent loop against a fake LLM backend."""
+    from .bench import run_benchmark, load_tasks, write_report, load_baseline, compare
+    from .agent import PLANNER_MODES
+    if planner not in PLANNER_MODES:
+        raise typer.BadParameter(f"must be one of {', '.join(PLANNER_MODES)}", param_hint="--planner")
+    report = asyncio.run(run_benchmark(
+        load_tasks(tasks),
+        planner_mode=planner,
+        repeat=repeat,
+        llm_latency=llm_latency,
+        token_delay=token_delay,
+        real_docker=real_docker
+    ))
+    if baseline:
+        report["regressions"] = compare(report["summary"], load_baseline(baseline), tolerance=tolerance)
+    write_report(report, out)
+    typer.echo(json.dumps(report["summary"], indent=2))
+    typer.echo(f"Report written to {out}")
+    for regression in report.get("regressions", []):
+        typer.echo(f"REGRESSION {regression['metric']}: {regression['baseline']} -> {regression['current']}", err=True)
+    if report.get("regressions"):
+        raise typer.Exit(code=1)
+
+@app.command("batch")
+def batch(
+    tasks: str = typer.Argument(..., help="JSONL file of tasks, one {\"id\": ..., \"input\": \"...\"} per line."),
+    out: str = typer.Option("batch_results.jsonl", "--out", help="Results are appended here as JSONL, one line per finished task."),
+    workers: int = typer.Option(None, "--workers", help="Concurrent workers, each with its own agent and sandbox (defaults to the CPU count)."),
+    task_timeout: float = typer.Option(None, "--task-timeout", help="Seconds before a task is cancelled and recorded as a timeout."),
+    reuse_sandbox: bool = typer.Option(False, "--reuse-sandbox", help="Keep a worker's sandbox between tasks instead of resetting it."),
+    run_cache: bool = typer.Option(False, "--run-cache", help="Reuse run_python_file results across tasks when script, workspace and packages are unchanged."),
+    cpus: float = typer.Option(0.0, "--cpus", help="CPU quota per sandbox, capped at the host's CPU count (0 = unlimited)."),
+    memory: str = typer.Option("", "--memory", help="Memory limit per sandbox, e.g. '512m' or '2g' (empty = unlimited)."),
+    pids: int = typer.Option(0, "--pids", help="Process limit per sandbox (0 = unlimited)."),
+    max_execs: int = typer.Option(0, "--max-execs", help="Script runs and pip installs allowed at once on this host, across all agent processes (0 = CPU count)."),
+    planner: str = typer.Option("two_phase", "--planner", help="Tool planning mode: 'two_phase' or 'fused'."),
+    llm_cache: str = typer.Option("off", "--llm-cache", help="Model response cache: 'off', 'cache', 'record' or 'replay'."),
+    llm_cache_dir: str = typer.Option(None, "--llm-cache-dir", help="Directory for cached model responses."),
+    tool_top_k: int = typer.Option(8, "--tool-top-k", help="Number of most relevant MCP tools offered per step (0 = all)."),
+    backend: str = typer.Option("groq", "--backend", help="LLM backend: 'groq' or 'openai'."),
+    base_url: str = typer.Option(None, "--base-url", help="Base URL of the OpenAI-compatible endpoint."),
+    model: str = typer.Option(None, "--model", help="Model name (defaults to the backend's default model)."),
+):
+    """Run a JSONL file of tasks headless across concurrent sandboxes."""
+    from .batch import run_batch, load_tasks as load_batch_tasks, default_workers
+    from .dockerClient import resource_limits
+    from .execScheduler import scheduler
+    scheduler.configure(max_execs)
+    from .agent import PLANNER_MODES
+    if planner not in PLANNER_MODES:
+        raise typer.BadParameter(f"must be one of {', '.join(PLANNER_MODES)}", param_hint="--planner")
+    if llm_cache not in LLM_CACHE_MODES:
+        raise typer.BadParameter(f"must be one of {', '.join(LLM_CACHE_MODES)}", param_hint="--llm-cache")
+    if backend not in LLM_BACKENDS:
+        raise typer.BadParameter(f"must be one of {', '.join(LLM_BACKENDS)}", param_hint="--backend")
+    if backend == "openai" and not base_url:
+        raise typer.BadParameter("is required with --backend openai", param_hint="--base-url")
+    try:
+        task_list = load_batch_tasks(tasks)
+    except (OSError, ValueError) as e:
+        raise typer.BadParameter(str(e), param_hint="TASKS")
+    llm_backend = make_backend(backend, base_url=base_url)
+
+    def report(result):
+        typer.echo(f"{result['id']}: {result['status']} in {result['seconds']}s (worker {result['worker']})", err=True)
+
+    async def run():
+        try:
+            with open(out, "a", encoding="utf-8") as f:
+                return await run_batch(
+                    task_list,
+                    f,
+                    workers=workers or default_workers(),
+                    task_timeout=task_timeout,
+                    reset_sandbox=not reuse_sandbox,
+                    run_cache=run_cache,
+                    limits=resource_limits(cpus=cpus, memory=memory, pids=pids),
+                    on_result=report,
+                    planner_mode=planner,
+                    llm_cache=LLMCache(mode=llm_cache, path=llm_cache_dir),
+                    tool_top_k=tool_top_k,
+                    backend=llm_backend,
+                    model=model
+                )
+        finally:
+            await llm_backend.close()
+
+    summary = asyncio.run(run())
+    typer.echo(json.dumps(summary, indent=2))
+    if summary["failed"]:
+        raise typer.Exit(code=1)
 
 if __name__ == "__main__":
-    app() 
\ No newline at end of file
+    app()
@@ -1,188 +1,173 @@
 import os
 from dotenv import load_dotenv
-from groq import Groq
 from typing import List, Dict, Any
 import json
-import subprocess
 import logging
+import asyncio
+import time
+from types import SimpleNamespace
+import threading
+from .mcpClient import MCPSession, MCPError, ToolCatalogCache
+from .context import ContextManager, count_tokens
+from .llmCache import LLMCache, response_from_message
+from .toolIndex import ToolIndex
+from .llmBackend import GroqBackend, LLMBackendError
+from .tracing import tracer
+from .toolRegistry import ToolRegistry, RegisteredTool, tool
+from .workspaceManifest import format_changes, format_size
+
+logger = logging.getLogger(__name__)
 
 # Maybe convert to Cerebras for faster inference
 # TO DO
 # Do more prompt engineering to figure out how to improve context aware sequential tool calls 
 # 'list files and make a python script to output those'
-logging.basicConfig(
-                level=logging.DEBUG,
-                filename="agent_debug.log",
-                filemode="a",
-                format="%(asctime)s %(levelname)s %(message)s"
-            )
-
 load_dotenv()
 
+PLANNER_MODES = ("two_phase", "fused")
+
 class AIAgent:
-    def __init__(self, docker_client):
-        self.groq = Groq()
+    def __init__(self, docker_client, refresh_tools=False, planner_mode="two_phase", tool_top_k=8, max_loops=3, context_budget=8000, llm_cache=None, backend=None, model=None, mcp_tools=None):
+        # Groq unless another backend (e.g. an OpenAI-compatible endpoint) is passed in
+        self.backend = backend or GroqBackend()
         # self.model = 'gemma2-9b-it'
-        self.model = 'llama-3.3-70b-versatile'
+        self.model = model or self.backend.default_model
         self.docker_client = docker_client
+        # "two_phase": select_tool by name, then a second call for the arguments
+        # "fused": one native tool-calling request over a reduced candidate set
+        if planner_mode not in PLANNER_MODES:
+            raise ValueError(f"Unknown planner mode: {planner_mode}")
+        self.planner_mode = planner_mode
+        # how many MCP tools (by BM25 relevance) go into planning prompts; 0 = all
+        self.tool_top_k = tool_top_k
+        self.tool_index = None
+        self.tool_index_key = None
+        self.max_loops = max_loops
+        self.llm_calls = 0
+        self.step_timings = []
+        self.cancel_event = threading.Event()
+        # on-disk response cache / record-replay; off unless one is passed in
+        self.llm_cache = llm_cache or LLMCache(mode="off")
+        self.mcp_session = None
+        # parallel MCP calls and the background catalog refresh share one session
+        self.mcp_session_lock = threading.Lock()
+        self.tool_cache = ToolCatalogCache()
 
-        # Get all MCP tools (summaries and full schema)
-        self.mcp_tools = self.fetch_mcp_tools()
+        # Local tools are the @tool methods below; MCP tools are registered by set_mcp_tools
+        self.registry = ToolRegistry()
+        self.registry.register_methods(self)
+        self.local_tools = self.registry.schemas(source="local")
+
+        # Get all MCP tools (summaries and full schema), from the on-disk cache when possible.
+        # A fixed catalog (e.g. [] for benchmarks) skips the cache and the MCP server.
+        if mcp_tools is not None:
+            self.set_mcp_tools(mcp_tools)
+        else:
+            cached_tools, stale = (None, True) if refresh_tools else self.tool_cache.load()
+            if cached_tools is None:
+                self.set_mcp_tools(self.fetch_mcp_tools())
+                if self.mcp_tools:
+                    self.tool_cache.save(self.mcp_tools)
+            else:
+                self.set_mcp_tools(cached_tools)
+                if stale:
+                    threading.Thread(target=self.refresh_mcp_tools, daemon=True).start()
+    
+        # history sent to the model, kept under a token budget
+        self.context = ContextManager(budget_tokens=context_budget)
+        self.system_prompt_short = '''You are an AI terminal agent. You can call tools in succession to accomplish multi-step user requests in a Docker container. For each user request, decide if you should call a tool or respond with text. If the request requires multiple actions, call the necessary tools one after another until all steps are complete, then respond with text. When several tool calls do not depend on each other you may make them together in one response. Only respond with text when you are done with all tool calls needed for the user's request.'''
+        self.system_prompt = self.system_prompt_short
+        self.fused_system_prompt = self.system_prompt_short + ''' The tools you are given are the candidates most relevant to the request. If one of them is the next step, call it with complete arguments. If the task is already complete, answer with text only.'''
+    
+    def set_mcp_tools(self, mcp_tools):
+        self.mcp_tools = mcp_tools
         self.mcp_tool_names = [tool["function"]["name"] for tool in self.mcp_tools]
         self.mcp_tool_summaries = [
             {"name": tool["function"]["name"], "description": tool["function"]["description"]}
             for tool in self.mcp_tools
         ]
-
-        # Local tools:
-        self.local_tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "create_python_file",
-                    "description": "Create a Python file in the Docker container",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "file_name": {
-                                "type": "string",
-                                "description": "Name of the Python file to create (e.g., 'test.py')"
-                            },
-                            "content": {
-                                "type": "string",
-                                "description": "Python code content to write to the file"
-                            }
-                        },
-                        "required": ["file_name", "content"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "run_python_file",
-                    "description": "Run a Python file in the Docker container",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "file_name": {
-                                "type": "string",
-                                "description": "Name of the Python file to run (e.g., 'test.py')"
-                            }
-                        },
-                        "required": ["file_name"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "list_files",
-                    "description": "List all the current files in the Docker container",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                        "required": []
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "install_dependency",
-                    "description": "Install a Python dependency in the Docker container using pip.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "dependency": {
-                                "type": "string",
-                                "description": "The name of the dependency to install, e.g., 'pandas' or 'numpy==1.25.0'"
-                            }
-                        },
-                        "required": ["dependency"]
-                    }
-                }
-            }
-            # {
-            #     "type": "function",
-            #     "function": {
-            #         "name": "get_me",
-            #         "description": "Get the authenticated user's GitHub profile information using MCP.",
-            #         "parameters": {
-            #             "type": "object",
-            #             "properties": {},
-            #             "required": []
-            #         }
-            #     }
-            # },
-            # {
-            #     "type": "function",
-            #     "function": {
-            #         "name": "search_repositories",
-            #         "description": "Search GitHub repositories using MCP.",
-            #         "parameters": {
-            #             "type": "object",
-            #             "properties": {
-            #                 "query": {
-            #                     "type": "string",
-            #                     "description": "The search query for repositories."
-            #                 },
-            #                 "per_page": {
-            #                     "type": "integer",
-            #                     "description": "Results per page (default 20)",
-            #                     "default": 20
-            #                 },
-            #                 "page": {
-            #                     "type": "integer",
-            #                     "description": "Page number (default 1)",
-            #                     "default": 1
-            #                 }
-            #             },
-            #             "required": ["query"]
-            #         }
-            #     }
-            # }
-            # {
-            #     "type": "function",
-            #     "function": {
-            #         "name": "run_shell_command",
-            #         "description": "Run a shell command inside the Docker container.",
-            #         "parameters": {
-            #             "type": "object",
-            #             "properties": {
-            #                 "command": {
-            #                     "type": "string",
-            #                     "description": "The shell command to run, e.g., 'ls -l' or 'cat requirements.txt'"
-            #                 }
-            #             },
-            #             "required": ["command"]
-            #         }
-            #     }
-            # }
-        ]
         self.tools = self.local_tools + self.mcp_tools
+        # inputSchema validators are compiled here once, not per call
+        self.registry.replace_source("mcp", [
+            RegisteredTool(
+                tool["function"]["name"],
+                tool["function"]["description"],
+                tool["function"]["parameters"],
+                self.mcp_tool_handler(tool["function"]["name"]),
+                source="mcp"
+            )
+            for tool in self.mcp_tools
+        ])
         self.tool_summaries = [
             {"name": tool["function"]["name"], "description": tool["function"]["description"]}
             for tool in self.tools
         ]
-    
-        self.conversation_history = []
-        self.system_prompt_short = '''You are an AI terminal agent. You can call tools in succession to accomplish multi-step user requests in a Docker container. For each user request, decide if you should call a tool or respond with text. If the request requires multiple actions, call the necessary tools one after another until all steps are complete, then respond with text. Remember to only call one tool per request. Only respond with text when you are done with all tool calls needed for the user's request.'''
-        self.system_prompt = self.system_prompt_short
-    
+        # the index is only rebuilt when the catalog actually changed
+        index_key = tuple((t["name"], t["description"]) for t in self.mcp_tool_summaries)
+        if index_key != self.tool_index_key:
+            self.tool_index = ToolIndex(self.mcp_tools)
+            self.tool_index_key = index_key
+
+    def refresh_mcp_tools(self):
+        # Runs in the background when the cached catalog is stale
+        mcp_tools = self.fetch_mcp_tools()
+        if mcp_tools:
+            self.set_mcp_tools(mcp_tools)
+            self.tool_cache.save(mcp_tools)
+        logger.debug(f"MCP tool catalog refreshed: {len(mcp_tools)} tools")
+
+    @property
+    def conversation_history(self):
+        return self.context.history()
+
     def add_message(self, role: str, content: str):
-        self.conversation_history.append({"role": role, "content": content})
+        self.context.add_message(role, content)
+
+    def build_messages(self, system_prompt, user_content):
+        # Budgeted history + system prompt + the current request
+        reserve = count_tokens(system_prompt) + count_tokens(user_content)
+        return [*self.context.build(reserve), {"role": "system", "content": system_prompt}, {"role": "user", "content": user_content}]
     
     # TOOL DEFINITIONS - uses dockerClient tools
+    @tool("list_files", "List the files in the Docker container workspace with their size and modification time, and which changed since the last step")
     def list_files(self):
         if self.docker_client:
             try:
                 files = self.docker_client.list_files()
-                return files
+                changes = self.docker_client.workspace_changes()
             except Exception as e:
                 return f"Error: {str(e)}"
+            if isinstance(files, str):
+                files = [{"path": f} for f in files.strip().splitlines() if f]
+            elif not isinstance(files, list):
+                files = []
+            lines = []
+            for entry in files:
+                if "size" in entry:
+                    modified = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["mtime"]))
+                    lines.append(f"- {entry['path']} ({format_size(entry['size'])}, modified {modified})")
+                else:
+                    lines.append(f"- {entry['path']}")
+            result = "The following files are present in the Docker container:\n" + "\n".join(lines)
+            if changes:
+                result += "\nChanged since the last step:\n" + "\n".join(format_changes(changes))
+            return result
         return "Docker client not available."
 
+    @tool("create_python_file", "Create a Python file in the Docker container", {
+        "type": "object",
+        "properties": {
+            "file_name": {
+                "type": "string",
+                "description": "Name of the Python file to create (e.g., 'test.py')"
+            },
+            "content": {
+                "type": "string",
+                "description": "Python code content to write to the file"
+            }
+        },
+        "required": ["file_name", "content"]
+    })
     def create_python_file(self, file_name, content):
         if self.docker_client:
             try:
@@ -192,23 +177,82 @@ class AIAgent:
                 return f"Error: {str(e)}"
         return "Docker client not available."
     
-    def run_python_file(self, file_name):
+    @tool("run_python_file", "Run a Python file in the Docker container", {
+        "type": "object",
+        "properties": {
+            "file_name": {
+                "type": "string",
+                "description": "Name of the Python file to run (e.g., 'test.py')"
+            }
+        },
+        "required": ["file_name"]
+    })
+    def run_python_file(self, file_name, on_output=None):
         if self.docker_client:
             try: 
-                output = self.docker_client.run_file(file_name)
+                output = self.docker_client.run_file(file_name, cancel_event=self.cancel_event, on_output=on_output)
+                # files the run created, changed or deleted, so the model needn't list them again
+                changes = self.docker_client.workspace_changes()
+                if changes:
+                    output["workspace_changes"] = format_changes(changes)
                 return output
             except Exception as e:
                 return f"Error: {str(e)}"
         return "Docker client not available."
 
-    def install_dependency(self, dependency):
+    @tool("install_dependency", "Install a Python dependency in the Docker container using pip.", {
+        "type": "object",
+        "properties": {
+            "dependency": {
+                "type": "string",
+                "description": "The dependency to install, e.g., 'pandas' or 'numpy==1.25.0'. Several can be given separated by spaces."
+            }
+        },
+        "required": ["dependency"]
+    })
+    def install_dependency(self, dependency, on_output=None):
+        if self.docker_client:
+            try:
+                return self.docker_client.install_dependency(dependency, cancel_event=self.cancel_event, on_output=on_output)
+            except Exception as e:
+                return f"Error: {str(e)}"
+        return "Docker client not available."
+
+    @tool("read_file", "Read the contents of a file in the Docker container", {
+        "type": "object",
+        "properties": {
+            "file_name": {
+                "type": "string",
+                "description": "Name of the file to read (e.g., 'output.txt')"
+            }
+        },
+        "required": ["file_name"]
+    })
+    def read_file(self, file_name):
         if self.docker_client:
             try:
-                return self.docker_client.install_dependency(dependency)
+                return self.docker_client.read_file(file_name)
             except Exception as e:
                 return f"Error: {str(e)}"
         return "Docker client not available."
 
+    @tool("get_tool_output", "Retrieve the full text of an earlier tool output that was shortened or omitted, by its output number", {
+        "type": "object",
+        "properties": {
+            "output_id": {
+                "type": "integer",
+                "description": "The output number shown as '#N' in the history"
+            },
+            "offset": {
+                "type": "integer",
+                "description": "Character offset to continue from (default 0)"
+            }
+        },
+        "required": ["output_id"]
+    })
+    def get_tool_output(self, output_id, offset=0):
+        return self.context.get_output(output_id=output_id, offset=offset or 0)
+
     # def run_shell_command(self, command):
     #     if self.docker_client:
     #         try:
@@ -217,41 +261,33 @@ class AIAgent:
     #             return f"Error: {str(e)}"
     #     return "Docker client not available."
 
+    def get_mcp_session(self, token):
+        # One long-lived MCP server per agent; a new token means a new session
+        with self.mcp_session_lock:
+            if self.mcp_session is None or self.mcp_session.token != token:
+                if self.mcp_session is not None:
+                    self.mcp_session.close()
+                self.mcp_session = MCPSession(token)
+            return self.mcp_session
+
+    def mcp_tool_handler(self, tool_name):
+        def handler(**arguments):
+            return self.call_mcp_stdio_tool(
+                tool_name=tool_name,
+                arguments=arguments,
+                docker_token=os.environ.get("GITHUB_PERSONAL_ACCESS_TOKEN")
+            )
+        return handler
+
     def call_mcp_stdio_tool(self, tool_name, arguments=None, docker_token=None):
         if arguments is None:
             arguments = {}
         if docker_token is None:
             raise ValueError("You must provide a GitHub token for MCP server.")
-        proc = subprocess.Popen(
-            [
-                "docker", "run", "-i", "--rm",
-                "-e", f"GITHUB_PERSONAL_ACCESS_TOKEN={docker_token}",
-                "ghcr.io/github/github-mcp-server"
-            ],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1
-        )
-        request = {
-            "jsonrpc": "2.0",
-            "id": 1,
-            "method": "tools/call",
-            "params": {
-                "name": tool_name,
-                "arguments": arguments
-            }
-        }
-        proc.stdin.write(json.dumps(request) + "\n")
-        proc.stdin.flush()
-        response_line = proc.stdout.readline()
         try:
-            response = json.loads(response_line)
-        except Exception as e:
-            response = {"error": f"Failed to parse response: {response_line}", "exception": str(e)}
-        proc.terminate()
-        return response
+            return self.get_mcp_session(docker_token).call_tool(tool_name, arguments)
+        except MCPError as e:
+            return {"error": f"MCP call to '{tool_name}' failed", "exception": str(e)}
 
     # def get_me(self):
     #     token = os.environ.get("GITHUB_PERSONAL_ACCESS_TOKEN")
@@ -270,78 +306,132 @@ class AIAgent:
 
         token = os.environ.get("GITHUB_PERSONAL_ACCESS_TOKEN")
         if not token:
-            logging.debug("[ERROR] GITHUB_PERSONAL_ACCESS_TOKEN not set.")
+            logger.debug("[ERROR] GITHUB_PERSONAL_ACCESS_TOKEN not set.")
             return
-        proc = subprocess.Popen(
-            [
-                "docker", "run", "-i", "--rm",
-                "-e", f"GITHUB_PERSONAL_ACCESS_TOKEN={token}",
-                "ghcr.io/github/github-mcp-server"
-            ],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1
-        )
-        request = {"jsonrpc": "2.0", "id": 1, "method": "tools/list"}
-        proc.stdin.write(json.dumps(request) + "\n")
-        proc.stdin.flush()
-        response_line = proc.stdout.readline()
         try:
-            response = json.loads(response_line)
-        except Exception as e:
-            response = {"error": f"Failed to parse response: {response_line}", "exception": str(e)}
-        proc.terminate()
-        logging.debug(f"MCP tools/list response: {response}")
+            response = self.get_mcp_session(token).list_tools()
+        except MCPError as e:
+            response = {"error": "Failed to list MCP tools", "exception": str(e)}
+        logger.debug("MCP tools/list response: %s", response)
 
     def fetch_mcp_tools(self):
         token = os.environ.get("GITHUB_PERSONAL_ACCESS_TOKEN")
         if not token:
-            logging.debug("[ERROR] GITHUB_PERSONAL_ACCESS_TOKEN not set.")
+            logger.debug("[ERROR] GITHUB_PERSONAL_ACCESS_TOKEN not set.")
             return []
-        proc = subprocess.Popen(
-            [
-                "docker", "run", "-i", "--rm",
-                "-e", f"GITHUB_PERSONAL_ACCESS_TOKEN={token}",
-                "ghcr.io/github/github-mcp-server"
-            ],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1
-        )
-        request = {"jsonrpc": "2.0", "id": 1, "method": "tools/list"}
-        proc.stdin.write(json.dumps(request) + "\n")
-        proc.stdin.flush()
-        response_line = proc.stdout.readline()
         try:
-            response = json.loads(response_line)
-            proc.terminate()
-            if "result" in response and "tools" in response["result"]:
-                return [
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": tool["name"],
-                            "description": tool.get("description", ""),
-                            "parameters": tool.get("inputSchema", {})
-                        }
-                    }
-                    for tool in response["result"]["tools"]
-                ]
-            else:
-                logging.debug(f"Unexpected MCP tools/list response: {response}")
-                return []
-        except Exception as e:
-            proc.terminate()
-            logging.debug(f"Failed to parse MCP tools/list response: {response_line}, error: {e}")
+            response = self.get_mcp_session(token).list_tools()
+        except MCPError as e:
+            logger.debug(f"Failed to fetch MCP tools/list: {e}")
             return []
+        if "result" in response and "tools" in response["result"]:
+            return [
+                {
+                    "type": "function",
+                    "function": {
+                        "name": tool["name"],
+                        "description": tool.get("description", ""),
+                        "parameters": tool.get("inputSchema", {})
+                    }
+                }
+                for tool in response["result"]["tools"]
+            ]
+        logger.debug("Unexpected MCP tools/list response: %s", response)
+        return []
 
-    def select_tool(self, user_input):
+    def close(self):
+        with self.mcp_session_lock:
+            if self.mcp_session is not None:
+                self.mcp_session.close()
+                self.mcp_session = None
+
+    def token_counts(self, kwargs, message, usage=None):
+        # Provider usage when reported, otherwise the same 4 chars/token estimate the context budget uses
+        if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+            return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+        prompt = json.dumps([kwargs.get("messages"), kwargs.get("tools")], default=str)
+        completion = (message.content or "") + "".join(
+            tool_call.function.name + tool_call.function.arguments for tool_call in message.tool_calls or []
+        )
+        return {"prompt_tokens": count_tokens(prompt), "completion_tokens": count_tokens(completion), "tokens_estimated": True}
+
+    async def create_completion(self, span_name="llm.complete", **kwargs):
+        # Every model call goes through here so it never blocks the event loop
+        self.llm_calls += 1
+        with tracer.span(span_name, model=self.model, backend=self.backend.name) as span:
+            if self.llm_cache.enabled:
+                cached = await asyncio.to_thread(self.llm_cache.get, self.model, kwargs)
+                if cached is not None:
+                    span.set(cache="hit")
+                    return response_from_message(cached)
+            response = await self.backend.complete(self.model, **kwargs)
+            span.set(**self.token_counts(kwargs, response.choices[0].message, getattr(response, "usage", None)))
+            if self.llm_cache.enabled:
+                await asyncio.to_thread(self.llm_cache.put, self.model, kwargs, response.choices[0].message)
+            return response
+
+    async def stream_completion(self, span_name="llm.stream", **kwargs):
+        # Yields ("delta", text) as tokens arrive, then ("message", assembled message)
+        self.llm_calls += 1
+        with tracer.span(span_name, activate=False, model=self.model, backend=self.backend.name) as span:
+            if self.llm_cache.enabled:
+                cached = await asyncio.to_thread(self.llm_cache.get, self.model, kwargs)
+                if cached is not None:
+                    span.set(cache="hit")
+                    if cached.content:
+                        yield "delta", cached.content
+                    yield "message", cached
+                    return
+            content = []
+            tool_calls = {}
+            usage = None
+            async for chunk in self.backend.stream(self.model, **kwargs):
+                if "ttft" not in span.attrs:
+                    span.set(ttft=round(span.elapsed(), 4))
+                # Groq reports usage on the last chunk under x_groq
+                usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content.append(delta.content)
+                    yield "delta", delta.content
+                for tool_call in delta.tool_calls or []:
+                    entry = tool_calls.setdefault(tool_call.index, {"id": None, "name": "", "arguments": ""})
+                    if tool_call.id:
+                        entry["id"] = tool_call.id
+                    if tool_call.function:
+                        entry["name"] += tool_call.function.name or ""
+                        entry["arguments"] += tool_call.function.arguments or ""
+            message = SimpleNamespace(
+                role="assistant",
+                content="".join(content) or None,
+                tool_calls=[
+                    SimpleNamespace(
+                        id=entry["id"],
+                        type="function",
+                        function=SimpleNamespace(name=entry["name"], arguments=entry["arguments"])
+                    )
+                    for _, entry in sorted(tool_calls.items())
+                ] or None
+            )
+            span.set(**self.token_counts(kwargs, message, usage))
+            if self.llm_cache.enabled:
+                await asyncio.to_thread(self.llm_cache.put, self.model, kwargs, message)
+        yield "message", message
+
+    def candidate_tools(self, current_input):
+        # Local tools plus the top-k MCP tools for the request and recent user messages
+        if not self.tool_top_k:
+            return self.tools
+        recent = [m["content"] for m in self.context.messages[-6:] if m["role"] == "user"]
+        query = " ".join([current_input, *recent])
+        return self.local_tools + self.tool_index.search(query, self.tool_top_k)
+
+    async def select_tool(self, user_input):
         tool_list_str = "\n".join(
-            f"{i+1}. {t['name']}: {t['description']}" for i, t in enumerate(self.tool_summaries)
+            f"{i+1}. {t['function']['name']}: {t['function']['description']}"
+            for i, t in enumerate(self.candidate_tools(user_input))
         )
         prompt = (
             f"User request and execution history: {user_input}\n\n"
@@ -351,8 +441,8 @@ class AIAgent:
             "- If tools have already been run, look at the history and reply ONLY with the name of the NEXT logical tool to continue the task.\n"
             "- If the task is complete or no tool is needed, reply with 'none'."
         )
-        response = self.groq.chat.completions.create(
-            model=self.model,
+        response = await self.create_completion(
+            span_name="llm.select_tool",
             messages=[{"role": "user", "content": prompt}],
             max_completion_tokens=128
         )
@@ -361,111 +451,313 @@ class AIAgent:
             return None, content[4:].strip()  # NLP answer
         return content, None
 
+    def execute_tool(self, tool_name, function_args, on_output=None):
+        # Blocking (Docker / MCP), called from a worker thread by process_input.
+        # on_output(stream, text) receives container output while it is produced.
+        return self.registry.dispatch(tool_name, function_args, on_output=on_output)
+
+    def parse_arguments(self, raw_arguments):
+        try:
+            function_args = json.loads(raw_arguments or "{}")
+        except ValueError:
+            return None
+        return function_args if isinstance(function_args, dict) else None
+
+    def tool_resources(self, tool_name, function_args):
+        # (resource, mode) pairs a call touches; calls sharing a resource where
+        # either side writes keep the order the model gave them
+        if tool_name == "create_python_file":
+            return [(f"file:{function_args.get('file_name')}", "w"), ("workspace", "w")]
+        if tool_name == "run_python_file":
+            # a script can create or change any file, so it writes the whole workspace
+            return [(f"file:{function_args.get('file_name')}", "w"), ("workspace", "w"), ("packages", "r")]
+        if tool_name == "read_file":
+            return [(f"file:{function_args.get('file_name')}", "r"), ("workspace", "r")]
+        if tool_name == "list_files":
+            return [("workspace", "r")]
+        if tool_name == "get_tool_output":
+            return []
+        if tool_name == "install_dependency":
+            return [("packages", "w")]
+        if tool_name in self.mcp_tool_names:
+            read_only = tool_name.startswith(("get_", "list_", "search_"))
+            return [("github", "r" if read_only else "w")]
+        return [("workspace", "w")]
+
+    async def run_tool_calls(self, tool_calls):
+        # Yields "exec_output" events while tools run and one "tool" event per
+        # call, in completion order
+        calls = []
+        for tool_call in tool_calls:
+            function_args = self.parse_arguments(tool_call.function.arguments)
+            if function_args is None:
+                function_args = {"_raw": tool_call.function.arguments, "_error": "arguments are not a JSON object"}
+            calls.append((tool_call.id, tool_call.function.name, function_args))
+
+        # several install_dependency calls in one response become one pip call
+        installs = [
+            args for _, name, args in calls
+            if name == "install_dependency" and "_error" not in args and not self.registry.validate(name, args)
+        ]
+        shared = {}
+        if len(installs) > 1:
+            shared["install_dependency"] = {"dependency": " ".join(str(args.get("dependency", "")) for args in installs)}
+
+        events = asyncio.Queue()
+        tasks = []
+        for i, (call_id, tool_name, function_args) in enumerate(calls):
+            resources = dict(self.tool_resources(tool_name, function_args))
+            waits_for = []
+            for j in range(i):
+                other = dict(self.tool_resources(*calls[j][1:]))
+                if any(key in other and "w" in (mode, other[key]) for key, mode in resources.items()):
+                    waits_for.append(tasks[j])
+            tasks.append(asyncio.ensure_future(self._run_tool_call(call_id, tool_name, function_args, waits_for, events, shared)))
+
+        try:
+            remaining = len(tasks)
+            while remaining:
+                event = await events.get()
+                if event["type"] == "tool":
+                    remaining -= 1
+                yield event
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _run_tool_call(self, call_id, tool_name, function_args, waits_for, events, shared):
+        if waits_for:
+            await asyncio.wait(waits_for)
+        loop = asyncio.get_running_loop()
+
+        def on_output(stream, text):
+            # called from the worker thread
+            loop.call_soon_threadsafe(events.put_nowait, {
+                "type": "exec_output", "call_id": call_id, "tool": tool_name, "stream": stream, "data": text
+            })
+
+        with tracer.span("tool", tool=tool_name, call_id=call_id) as span:
+            errors = [] if "_error" in function_args else self.registry.validate(tool_name, function_args)
+            if "_error" in function_args:
+                tool_result = f"Error: invalid JSON arguments: {function_args['_error']}"
+            elif errors:
+                # rejected before any Docker / MCP work; the model sees why and can retry
+                tool_result = f"Error: invalid arguments for '{tool_name}': " + "; ".join(errors)
+            else:
+                try:
+                    if tool_name in shared:
+                        # batched call: the first one runs it, the rest reuse its result
+                        if not isinstance(shared[tool_name], asyncio.Future):
+                            shared[tool_name] = asyncio.ensure_future(
+                                asyncio.to_thread(self.execute_tool, tool_name, shared[tool_name], on_output)
+                            )
+                        tool_result = await asyncio.shield(shared[tool_name])
+                    else:
+                        tool_result = await asyncio.to_thread(self.execute_tool, tool_name, function_args, on_output)
+                except Exception as e:
+                    tool_result = f"Error: {str(e)}"
+            span.set(rejected=bool(errors) or "_error" in function_args, result_chars=len(str(tool_result)))
+        events.put_nowait({
+            "type": "tool", "call_id": call_id, "tool": tool_name, "args": function_args, "output": tool_result
+        })
+
+    async def plan_two_phase(self, current_input, user_input):
+        # Yields text_delta events while a final answer streams, then
+        # {"type": "plan", "plan": {"text": ...} or {"tool_calls": [...]}}
+        chosen_tool_name, nl_response = await self.select_tool(current_input)
+        if nl_response:
+            yield {"type": "plan", "plan": {"text": nl_response}}
+            return
+        if not chosen_tool_name:
+            # If no tool is selected, attempt to generate a natural language response
+            nl_response_messages = self.build_messages(self.system_prompt, user_input)
+            async for kind, value in self.stream_completion(
+                span_name="llm.answer",
+                messages=nl_response_messages,
+                max_completion_tokens=4096
+            ):
+                if kind == "delta":
+                    yield {"type": "text_delta", "delta": value}
+            yield {"type": "plan", "plan": {"text": value.content, "streamed": True}}
+            return
+        registered = self.registry.get(chosen_tool_name)
+        if not registered:
+            yield {"type": "plan", "plan": {"text": f"\\[Tool '{chosen_tool_name}' not found in available tools.]", "error": True}}
+            return
+
+        # Prepare messages for the LLM, including all conversation history and tool outputs
+        messages = self.build_messages(self.system_prompt, current_input)
+        async for kind, value in self.stream_completion(
+            span_name="llm.tool_arguments",
+            messages=messages,
+            tools=[registered.schema],
+            tool_choice="auto",
+            max_completion_tokens=4096
+        ):
+            if kind == "delta":
+                yield {"type": "text_delta", "delta": value}
+        if not value.tool_calls:
+            # If no tool call, treat as final response
+            yield {"type": "plan", "plan": {"text": value.content, "streamed": True}}
+            return
+        yield {"type": "plan", "plan": {"tool_calls": value.tool_calls}}
+
+    def looks_like_tool_text(self, content, tool_names):
+        # Tool calls written out as text mean the model wanted a tool but didn't call it
+        content = content.lstrip()
+        return content.startswith("<function") or content.split("(")[0].strip() in tool_names
+
+    async def plan_fused(self, current_input):
+        # Tool and arguments in one round trip. The plan is None when the output is
+        # ambiguous so the caller can fall back to the two-phase path.
+        candidates = self.candidate_tools(current_input)
+        candidate_names = {tool["function"]["name"] for tool in candidates}
+        messages = self.build_messages(self.fused_system_prompt, current_input)
+        # Text is held back until it clearly isn't a tool call written out as text
+        pending = ""
+        released = False
+        try:
+            async for kind, value in self.stream_completion(
+                span_name="llm.fused",
+                messages=messages,
+                tools=candidates,
+                tool_choice="auto",
+                max_completion_tokens=4096
+            ):
+                if kind != "delta":
+                    break
+                if released:
+                    yield {"type": "text_delta", "delta": value}
+                    continue
+                pending += value
+                if len(pending.strip()) >= 32 and not self.looks_like_tool_text(pending, candidate_names):
+                    released = True
+                    yield {"type": "text_delta", "delta": pending}
+        except LLMBackendError as e:
+            # e.g. Groq rejects malformed tool calls (tool_use_failed)
+            logger.debug(f"Fused planner request failed: {e}")
+            yield {"type": "plan", "plan": None}
+            return
+        if value.tool_calls:
+            valid = all(
+                tool_call.function.name in candidate_names and self.parse_arguments(tool_call.function.arguments) is not None
+                for tool_call in value.tool_calls
+            )
+            yield {"type": "plan", "plan": {"tool_calls": value.tool_calls} if valid else None}
+            return
+        content = (value.content or "").strip()
+        if not content or self.looks_like_tool_text(content, candidate_names):
+            yield {"type": "plan", "plan": None}
+            return
+        if not released:
+            yield {"type": "text_delta", "delta": value.content}
+        yield {"type": "plan", "plan": {"text": content, "streamed": True}}
+
+    async def plan_step(self, current_input, user_input):
+        # Forwards text deltas, then yields {"type": "plan", "plan": ..., "timing": ...}
+        step_start = time.perf_counter()
+        first_token = None
+        calls_before = self.llm_calls
+        mode = self.planner_mode
+        plan = None
+        with tracer.span("plan", mode=mode) as span:
+            planners = [self.plan_fused(current_input)] if mode == "fused" else []
+            planners.append(self.plan_two_phase(current_input, user_input))
+            for planner in planners:
+                async for event in planner:
+                    if event["type"] == "plan":
+                        plan = event["plan"]
+                        continue
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    yield event
+                if plan is not None:
+                    break
+                logger.debug("Fused planner output was ambiguous, falling back to two-phase")
+                mode = "fused_fallback"
+            timing = {
+                "mode": mode,
+                "step": len(self.step_timings) + 1,
+                "llm_calls": self.llm_calls - calls_before,
+                "seconds": round(time.perf_counter() - step_start, 4),
+                "ttft": round(first_token - step_start, 4) if first_token else None
+            }
+            span.set(**timing)
+        self.step_timings.append(timing)
+        logger.debug("Planning step latency: %s", timing)
+        yield {"type": "plan", "plan": plan, "timing": timing}
+
+    def latency_summary(self):
+        # Per planner mode: number of steps, LLM calls per step and mean/median latency
+        summary = {}
+        for mode in {t["mode"] for t in self.step_timings}:
+            timings = [t for t in self.step_timings if t["mode"] == mode]
+            seconds = sorted(t["seconds"] for t in timings)
+            summary[mode] = {
+                "steps": len(timings),
+                "llm_calls_per_step": sum(t["llm_calls"] for t in timings) / len(timings),
+                "mean_seconds": sum(seconds) / len(seconds),
+                "median_seconds": seconds[len(seconds) // 2]
+            }
+        return summary
+
     async def process_input(self, user_input: str):
         original_prompt = {"role": "user", "content": user_input}
+        self.cancel_event = threading.Event()
         self.add_message("user", user_input)
         tool_outputs = []
-        max_loops = 3
+        max_loops = self.max_loops
         loop_count = 0
         last_tool_output = None
         current_input = user_input
         
-        while loop_count < max_loops:
-            # Select tool for the current input (which may include previous tool output)
-            chosen_tool_name, nl_response = self.select_tool(current_input)
-            if nl_response:
-                self.add_message("assistant", nl_response)
-                yield {"type": "text", "response": nl_response}
-                return
-            if not chosen_tool_name:
-                # If no tool is selected, attempt to generate a natural language response
-                nl_response_messages = [*self.conversation_history, {"role": "system", "content": self.system_prompt}, {"role": "user", "content": user_input}]
-                nl_response = self.groq.chat.completions.create(
-                    model=self.model,
-                    messages=nl_response_messages,
-                    stream=False,
-                    max_completion_tokens=4096
-                )
-                final_response = nl_response.choices[0].message.content
-                self.add_message("assistant", final_response)
-                yield {"type": "text", "response": final_response}
-                return
-            selected_tool = next((tool for tool in self.tools if tool["function"]["name"] == chosen_tool_name), None)
-            if not selected_tool:
-                yield {"type": "text", "response": f"\[Tool '{chosen_tool_name}' not found in available tools.]"}
-                return
-
-            # Prepare messages for the LLM, including all conversation history and tool outputs
-            messages = [*self.conversation_history, {"role": "system", "content": self.system_prompt}, {"role": "user", "content": current_input}]
-            response = self.groq.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                stream=False,
-                tools=[selected_tool],
-                tool_choice="auto",
-                max_completion_tokens=4096
-            )
-            response_message = response.choices[0].message
-            tool_calls = response_message.tool_calls
-            if not tool_calls:
-                # If no tool call, treat as final response
-                self.add_message("assistant", response_message.content)
-                yield {"type": "text", "response": response_message.content}
-                return
-            tool_call = tool_calls[0]
-            function_args = json.loads(tool_call.function.arguments)
-            # Run the tool (local or MCP)
-            if chosen_tool_name in [t["function"]["name"] for t in self.local_tools]:
-                if chosen_tool_name == "create_python_file":
-                    tool_result = self.create_python_file(
-                        file_name=function_args.get("file_name"),
-                        content=function_args.get("content")
-                    )
-                elif chosen_tool_name == "run_python_file":
-                    tool_result = self.run_python_file(
-                        file_name=function_args.get("file_name")
-                    )
-                elif chosen_tool_name == "list_files":
-                    tool_result = self.list_files()
-                    if isinstance(tool_result, str):
-                        files = [f for f in tool_result.strip().splitlines() if f]
-                    elif isinstance(tool_result, list):
-                        files = tool_result
-                    else:
-                        files = []
-                    tool_result = "The following files are present in the Docker container:\n" + "\n".join(f"- {f}" for f in files)
-                elif chosen_tool_name == "install_dependency":
-                    tool_result = self.install_dependency(
-                        dependency=function_args.get("dependency")
-                    )
-                else:
-                    tool_result = f"Unknown local tool: {chosen_tool_name}"
+        with tracer.span("turn", planner=self.planner_mode, input_chars=len(user_input)):
+            try:
+                while loop_count < max_loops:
+                    # Plan the next step for the current input (which may include previous tool output)
+                    async for event in self.plan_step(current_input, user_input):
+                        if event["type"] == "plan":
+                            plan, timing = event["plan"], event["timing"]
+                        else:
+                            yield event
+                    yield {"type": "latency", **timing}
+                    if "text" in plan:
+                        if not plan.get("error"):
+                            self.add_message("assistant", plan["text"])
+                        yield {"type": "text", "response": plan["text"], "streamed": plan.get("streamed", False)}
+                        return
+                    # Run the tools (local or MCP) off the event loop, independent ones concurrently
+                    async for event in self.run_tool_calls(plan["tool_calls"]):
+                        # Yield container output as it streams and each tool result as soon as it finishes
+                        yield event
+                        if event["type"] != "tool":
+                            continue
+                        chosen_tool_name, function_args, tool_result = event["tool"], event["args"], event["output"]
+
+                        # Add tool output to conversation history (full output stored out-of-band)
+                        output_id = self.context.add_tool_output(chosen_tool_name, function_args, tool_result)
+                        # Accumulate tool output
+                        tool_outputs.append({"tool": chosen_tool_name, "args": function_args, "output": tool_result, "output_id": output_id})
+                        last_tool_output = tool_result
+                    # Prepare next input: user request + tool outputs so far, large ones cut to head and tail
+                    # and older ones collapsed to references once over budget
+                    all_tool_outputs = self.context.outputs_summary([o['output_id'] for o in tool_outputs])
+                    current_input = f"User request: {user_input}\nPrevious tool outputs: {all_tool_outputs}"
+                    loop_count += 1
+                    # If the model should stop (e.g., no more tool calls), check in next loop
+            except asyncio.CancelledError:
+                # Turn cancelled from the UI: kill running container processes and keep
+                # the history consistent for the next request
+                self.cancel_event.set()
+                self.add_message("assistant", "[Turn cancelled by user.]")
+                raise
+            # If max_loops reached, return last tool output
+            if tool_outputs:
+                yield {"type": "tool", "tool": tool_outputs[-1]["tool"], "args": tool_outputs[-1]["args"], "output": tool_outputs[-1]["output"]}
             else:
-                tool_result = self.call_mcp_stdio_tool(
-                    tool_name=tool_call.function.name,
-                    arguments=function_args,
-                    docker_token=os.environ.get("GITHUB_PERSONAL_ACCESS_TOKEN")
-                )
-            # Yield the output of the tool immediately
-            yield {"type": "tool", "tool": chosen_tool_name, "args": function_args, "output": tool_result}
-
-            # Accumulate tool output
-            tool_outputs.append({"tool": chosen_tool_name, "args": function_args, "output": tool_result})
-            last_tool_output = tool_result
-            # Add tool output to conversation history as assistant message
-            self.add_message("assistant", f"Tool '{chosen_tool_name}' output: {tool_result}")
-            # Prepare next input: user request + all tool outputs so far
-            all_tool_outputs = "\n".join([f"Tool: {o['tool']}, Args: {o['args']}, Output: {o['output']}" for o in tool_outputs])
-            current_input = f"User request: {user_input}\nPrevious tool outputs: {all_tool_outputs}"
-            loop_count += 1
-            # If the model should stop (e.g., no more tool calls), check in next loop
-        # If max_loops reached, return last tool output
-        if tool_outputs:
-            yield {"type": "tool", "tool": tool_outputs[-1]["tool"], "args": tool_outputs[-1]["args"], "output": tool_outputs[-1]["output"]}
-        else:
-            yield {"type": "text", "response": "[No relevant tool found and no response generated.]"}
-        return
+                yield {"type": "text", "response": "[No relevant tool found and no response generated.]"}
+            return
 
     async def process_input_stream(self, user_input: str):
         async for event in self.process_input(user_input):
-            yield event
\ No newline at end of file
+            yield event
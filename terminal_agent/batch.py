@@ -0,0 +1,142 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .agent import AIAgent
+from .bench import percentile
+from .execScheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Headless runs: tasks from a JSONL file ({"id": ..., "input": "..."} per line)
+# are worked off by N concurrent workers. Each worker has its own AIAgent and
+# its own sandbox leased from a SandboxPool, and every result is appended to
+# the output JSONL as soon as it is done.
+
+def load_tasks(path):
+    tasks = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            if isinstance(task, str):
+                task = {"input": task}
+            if not task.get("input"):
+                raise ValueError(f"{path}:{line_number}: task has no 'input'")
+            task.setdefault("id", str(line_number))
+            tasks.append(task)
+    return tasks
+
+async def run_task(agent, task, timeout=None):
+    started = time.perf_counter()
+    calls_before = agent.llm_calls
+    result = {"id": task["id"], "input": task["input"], "status": "ok", "response": None, "tools": [], "error": None}
+
+    async def consume():
+        async for event in agent.process_input(task["input"]):
+            if event["type"] == "tool" and event.get("call_id"):
+                result["tools"].append({"tool": event["tool"], "args": event["args"], "output": event["output"]})
+            elif event["type"] == "text":
+                result["response"] = event["response"]
+            elif event["type"] == "tool":
+                # loop limit reached: the last tool output is the answer
+                result["response"] = event["output"]
+
+    try:
+        await asyncio.wait_for(consume(), timeout)
+    except asyncio.TimeoutError:
+        result["status"] = "timeout"
+        result["error"] = f"Task exceeded {timeout}s"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+        logger.debug(f"Batch task {task['id']} failed: {result['error']}")
+    result["llm_calls"] = agent.llm_calls - calls_before
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+async def run_batch(tasks, out, workers=4, make_container=None, task_timeout=None, reset_sandbox=True,
+                    run_cache=False, limits=None, on_result=None, **agent_options):
+    # make_container() builds one sandbox client per worker (by default a
+    # DockerExecution leasing from a pool of warm sandboxes); agent_options go to AIAgent
+    loop = asyncio.get_running_loop()
+    # every worker blocks threads on Docker execs; the default executor is too small for many workers
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max(workers * 4, 8), thread_name_prefix="batch"))
+    queue = asyncio.Queue()
+    for task in tasks:
+        queue.put_nowait(task)
+    catalog = {"tools": agent_options.pop("mcp_tools", None)}
+    catalog_lock = asyncio.Lock()
+    results = []
+    pool = None
+    if make_container is None:
+        from .dockerClient import DockerExecution
+        from .sandboxPool import SandboxPool
+        from .runCache import RunCache
+        # twice the workers, so a fresh sandbox is warm while the returned one is reset
+        pool = SandboxPool(size=min(2 * workers, len(tasks)) or 1, limits=limits)
+        await asyncio.to_thread(pool.start)
+        # one cache shared by all workers, so identical runs in different tasks hit too
+        shared_cache = RunCache() if run_cache else None
+        make_container = lambda: DockerExecution(pool=pool, run_cache=shared_cache, limits=limits)
+    started = time.perf_counter()
+
+    async def worker(worker_id):
+        docker_client = await asyncio.to_thread(make_container)
+        await asyncio.to_thread(docker_client.start_container)
+        # the first worker fetches the MCP catalog, the others reuse it
+        async with catalog_lock:
+            agent = await asyncio.to_thread(AIAgent, docker_client, mcp_tools=catalog["tools"], **agent_options)
+            if catalog["tools"] is None:
+                catalog["tools"] = agent.mcp_tools
+        done = 0
+        try:
+            while True:
+                try:
+                    task = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if done and reset_sandbox:
+                    # fresh sandbox per task (a pooled one is reset when returned)
+                    await asyncio.to_thread(docker_client.end_container)
+                    await asyncio.to_thread(docker_client.start_container)
+                agent.context.clear()
+                result = await run_task(agent, task, timeout=task_timeout)
+                result["worker"] = worker_id
+                results.append(result)
+                out.write(json.dumps(result, default=str) + "\n")
+                out.flush()
+                if on_result is not None:
+                    on_result(result)
+                done += 1
+        finally:
+            agent.close()
+            # this worker leases no more sandboxes, so none is started to replace it
+            await asyncio.to_thread(docker_client.end_container, refill=False)
+
+    try:
+        await asyncio.gather(*(worker(i) for i in range(min(workers, len(tasks)) or 1)))
+    finally:
+        if pool is not None:
+            await asyncio.to_thread(pool.shutdown)
+    elapsed = time.perf_counter() - started
+    latencies = [r["seconds"] for r in results]
+    return {
+        "tasks": len(results),
+        "ok": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(1 for r in results if r["status"] != "ok"),
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "tasks_per_min": round(len(results) / elapsed * 60, 2) if elapsed else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_max": max(latencies) if latencies else None,
+        "llm_calls": sum(r["llm_calls"] for r in results),
+        "exec_scheduler": scheduler.stats()
+    }
+
+def default_workers():
+    return os.cpu_count() or 4
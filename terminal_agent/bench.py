@@ -0,0 +1,319 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from types import SimpleNamespace
+from .agent import AIAgent
+from .llmBackend import LLMBackendError, namespace_message, namespace_chunk
+from .localLLMServer import ScriptedReplies, load_script
+
+logger = logging.getLogger(__name__)
+
+# End-to-end benchmark of AIAgent.process_input: a corpus of scripted tasks runs
+# against an in-process fake LLM backend and a fake (or real) container, and
+# the results are written as JSON so runs can be compared with a baseline.
+# A task is {"id", "input", "script": [...replies...]}; "scripts" can hold a
+# separate script per planner mode. Replies use the stand-in server format.
+
+DEFAULT_TASKS = [
+    {
+        "id": "answer",
+        "input": "What is a Python virtual environment?",
+        "scripts": {
+            "fused": [{"content": "A virtual environment is an isolated set of installed Python packages."}],
+            "two_phase": [{"content": "none A virtual environment is an isolated set of installed Python packages."}]
+        }
+    },
+    {
+        "id": "list_files",
+        "input": "list the files in the container",
+        "scripts": {
+            "fused": [
+                {"tool_calls": [{"name": "list_files", "arguments": {}}]},
+                {"content": "The container has no files except the ones listed above."}
+            ],
+            "two_phase": [
+                {"content": "list_files"},
+                {"tool_calls": [{"name": "list_files", "arguments": {}}]},
+                {"content": "none The container has no files except the ones listed above."}
+            ]
+        }
+    },
+    {
+        "id": "create_and_run",
+        "input": "write hello.py that prints hello and run it",
+        "scripts": {
+            "fused": [
+                {"tool_calls": [{"name": "create_python_file", "arguments": {"file_name": "hello.py", "content": "print('hello')"}}]},
+                {"tool_calls": [{"name": "run_python_file", "arguments": {"file_name": "hello.py"}}]},
+                {"content": "hello.py printed hello."}
+            ],
+            "two_phase": [
+                {"content": "create_python_file"},
+                {"tool_calls": [{"name": "create_python_file", "arguments": {"file_name": "hello.py", "content": "print('hello')"}}]},
+                {"content": "run_python_file"},
+                {"tool_calls": [{"name": "run_python_file", "arguments": {"file_name": "hello.py"}}]},
+                {"content": "none hello.py printed hello."}
+            ]
+        }
+    },
+    {
+        "id": "install_parallel",
+        "input": "install numpy and pandas, then write and run a script using both",
+        "scripts": {
+            "fused": [
+                {"tool_calls": [
+                    {"name": "install_dependency", "arguments": {"dependency": "numpy"}},
+                    {"name": "install_dependency", "arguments": {"dependency": "pandas"}},
+                    {"name": "create_python_file", "arguments": {"file_name": "stats.py", "content": "import numpy, pandas\nprint(pandas.Series(numpy.arange(5)).sum())"}}
+                ]},
+                {"tool_calls": [{"name": "run_python_file", "arguments": {"file_name": "stats.py"}}]},
+                {"content": "stats.py printed the sum."}
+            ],
+            "two_phase": [
+                {"content": "install_dependency"},
+                {"tool_calls": [{"name": "install_dependency", "arguments": {"dependency": "numpy pandas"}}]},
+                {"content": "create_python_file"},
+                {"tool_calls": [{"name": "create_python_file", "arguments": {"file_name": "stats.py", "content": "import numpy, pandas\nprint(pandas.Series(numpy.arange(5)).sum())"}}]},
+                {"content": "run_python_file"},
+                {"tool_calls": [{"name": "run_python_file", "arguments": {"file_name": "stats.py"}}]}
+            ]
+        }
+    }
+]
+
+# Lower is better for all of these; a value above baseline * (1 + tolerance) is a regression
+COMPARED_METRICS = [
+    "step_seconds_p50", "step_seconds_p90", "step_seconds_p99",
+    "task_seconds_p50", "task_seconds_p90",
+    "llm_calls_per_task", "prompt_tokens_per_task", "completion_tokens_per_task",
+    "exec_seconds_per_task"
+]
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+class FakeBackend:
+    # In-process LLM backend serving a script, with token accounting
+    name = "fake"
+    default_model = "fake-model"
+
+    def __init__(self, script, latency=0.0, token_delay=0.0):
+        self.replies = ScriptedReplies(script, latency=latency, token_delay=token_delay)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def _reply(self, model, params, stream):
+        request = {"model": model, **params, "stream": stream}
+        reply = self.replies.next_reply(request)
+        if "error" in reply:
+            raise LLMBackendError(reply["error"])
+        completion = self.replies.completion(request, reply)
+        self.prompt_tokens += completion["usage"]["prompt_tokens"]
+        self.completion_tokens += completion["usage"]["completion_tokens"]
+        return reply, completion
+
+    async def complete(self, model, **params):
+        reply, completion = self._reply(model, params, False)
+        await asyncio.sleep(reply.get("latency", self.replies.latency))
+        choice = completion["choices"][0]
+        return SimpleNamespace(
+            choices=[SimpleNamespace(index=0, message=namespace_message(choice["message"]), finish_reason=choice["finish_reason"])],
+            usage=SimpleNamespace(**completion["usage"])
+        )
+
+    async def stream(self, model, **params):
+        reply, completion = self._reply(model, params, True)
+        await asyncio.sleep(reply.get("latency", self.replies.latency))
+        token_delay = reply.get("token_delay", self.replies.token_delay)
+        for i, chunk in enumerate(self.replies.stream_chunks(completion)):
+            if i and token_delay:
+                await asyncio.sleep(token_delay)
+            yield namespace_chunk(chunk)
+
+    async def close(self):
+        pass
+
+class FakeContainer:
+    # Stands in for DockerExecution: files live in a dict, runs and installs
+    # only sleep for a fixed time
+
+    def __init__(self, run_latency=0.05, install_latency=0.2):
+        self.run_latency = run_latency
+        self.install_latency = install_latency
+        self.files = {}
+
+    def start_container(self):
+        pass
+
+    def end_container(self, refill=True):
+        pass
+
+    def write_file(self, file_path, content):
+        self.files[file_path] = content
+
+    def read_file(self, file_path, binary=False):
+        if file_path not in self.files:
+            raise FileNotFoundError(file_path)
+        return self.files[file_path]
+
+    def list_files(self):
+        return "\n".join(sorted(self.files))
+
+    def workspace_changes(self):
+        return []
+
+    def run_file(self, file_name, timeout=None, cancel_event=None, on_output=None):
+        time.sleep(self.run_latency)
+        if file_name not in self.files:
+            return {'exit_code': 2, 'output': f"python: can't open file '{file_name}'", 'duration': self.run_latency}
+        output = f"{file_name}: ok\n"
+        if on_output is not None:
+            on_output("stdout", output)
+        return {'exit_code': 0, 'output': output, 'duration': self.run_latency}
+
+    def install_dependency(self, dependency, timeout=None, cancel_event=None, on_output=None):
+        time.sleep(self.install_latency)
+        output = f"Successfully installed {dependency}\n"
+        if on_output is not None:
+            on_output("stdout", output)
+        return {'exit_code': 0, 'output': output, 'duration': self.install_latency, 'skipped': []}
+
+class TimedContainer:
+    # Wraps a container client and adds up the time spent in its calls
+    TIMED = ("write_file", "read_file", "list_files", "run_file", "install_dependency")
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.exec_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.inner, name)
+        if name not in self.TIMED:
+            return attr
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.exec_seconds += time.perf_counter() - started
+        return timed
+
+async def run_task(task, planner_mode, container, llm_latency=0.0, token_delay=0.0):
+    script = (task.get("scripts") or {}).get(planner_mode, task.get("script") or [])
+    backend = FakeBackend(script, latency=llm_latency, token_delay=token_delay)
+    timed = TimedContainer(container)
+    agent = AIAgent(timed, planner_mode=planner_mode, backend=backend, mcp_tools=[])
+    step_seconds = []
+    ttfts = []
+    tools = 0
+    error = None
+    started = time.perf_counter()
+    try:
+        async for event in agent.process_input(task["input"]):
+            if event["type"] == "latency":
+                step_seconds.append(event["seconds"])
+                if event.get("ttft") is not None:
+                    ttfts.append(event["ttft"])
+            elif event["type"] == "tool" and event.get("call_id"):
+                # without a call_id it is the last output repeated at the loop limit
+                tools += 1
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        logger.debug(f"Benchmark task {task['id']} failed: {error}")
+    return {
+        "id": task["id"],
+        "seconds": round(time.perf_counter() - started, 4),
+        "steps": len(step_seconds),
+        "step_seconds": step_seconds,
+        "ttft_seconds": ttfts,
+        "llm_calls": agent.llm_calls,
+        "prompt_tokens": backend.prompt_tokens,
+        "completion_tokens": backend.completion_tokens,
+        "tool_calls": tools,
+        "exec_seconds": round(timed.exec_seconds, 4),
+        "unused_replies": len(backend.replies.queue),
+        "error": error
+    }
+
+def summarize(results):
+    steps = [s for r in results for s in r["step_seconds"]]
+    ttfts = [s for r in results for s in r["ttft_seconds"]]
+    tasks = [r["seconds"] for r in results]
+    count = len(results) or 1
+    return {
+        "tasks": len(results),
+        "errors": sum(1 for r in results if r["error"]),
+        "step_seconds_p50": percentile(steps, 50),
+        "step_seconds_p90": percentile(steps, 90),
+        "step_seconds_p99": percentile(steps, 99),
+        "ttft_seconds_p50": percentile(ttfts, 50),
+        "task_seconds_p50": percentile(tasks, 50),
+        "task_seconds_p90": percentile(tasks, 90),
+        "llm_calls_per_task": sum(r["llm_calls"] for r in results) / count,
+        "prompt_tokens_per_task": sum(r["prompt_tokens"] for r in results) / count,
+        "completion_tokens_per_task": sum(r["completion_tokens"] for r in results) / count,
+        "exec_seconds_per_task": sum(r["exec_seconds"] for r in results) / count
+    }
+
+def compare(summary, baseline, tolerance=0.2):
+    # Metrics that got worse than the baseline by more than the tolerance
+    regressions = []
+    for metric in COMPARED_METRICS:
+        current, previous = summary.get(metric), baseline.get(metric)
+        if current is None or previous is None:
+            continue
+        if current > previous * (1 + tolerance) and current - previous > 1e-3:
+            regressions.append({"metric": metric, "baseline": previous, "current": current})
+    return regressions
+
+def load_tasks(path=None):
+    return load_script(path) if path else DEFAULT_TASKS
+
+async def run_benchmark(tasks, planner_mode="fused", repeat=1, llm_latency=0.0, token_delay=0.0,
+                        run_latency=0.05, install_latency=0.2, real_docker=False):
+    results = []
+    docker_client = None
+    if real_docker:
+        from .dockerClient import DockerExecution
+        docker_client = DockerExecution()
+        docker_client.start_container()
+    try:
+        for _ in range(repeat):
+            for task in tasks:
+                container = docker_client or FakeContainer(run_latency=run_latency, install_latency=install_latency)
+                results.append(await run_task(task, planner_mode, container, llm_latency=llm_latency, token_delay=token_delay))
+    finally:
+        if docker_client is not None:
+            docker_client.end_container()
+    return {
+        "config": {
+            "planner": planner_mode,
+            "repeat": repeat,
+            "llm_latency": llm_latency,
+            "token_delay": token_delay,
+            "container": "docker" if real_docker else "fake",
+            "run_latency": None if real_docker else run_latency,
+            "install_latency": None if real_docker else install_latency
+        },
+        "summary": summarize(results),
+        "tasks": results
+    }
+
+def write_report(report, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+def load_baseline(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    # a full report or just its summary
+    return data.get("summary", data)
@@ -0,0 +1,131 @@
+import json
+
+# Keeps the conversation sent to the model under a token budget. Tool outputs
+# are stored in full out-of-band; the history only carries the head and tail
+# of large ones, and old ones collapse to a one-line reference once the
+# budget is tight. The model can fetch stored outputs with get_tool_output.
+
+CHARS_PER_TOKEN = 4
+
+def count_tokens(text):
+    # Rough estimate, good enough for budgeting without a tokenizer dependency
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def head_tail(text, head_tokens, tail_tokens, note=""):
+    head_chars = head_tokens * CHARS_PER_TOKEN
+    tail_chars = tail_tokens * CHARS_PER_TOKEN
+    if len(text) <= head_chars + tail_chars:
+        return text
+    omitted = count_tokens(text[head_chars:len(text) - tail_chars])
+    return f"{text[:head_chars]}\n...[{omitted} tokens omitted{note}]...\n{text[len(text) - tail_chars:]}"
+
+class ContextManager:
+
+    def __init__(self, budget_tokens=8000, max_output_tokens=800, head_tokens=400, tail_tokens=300):
+        self.budget_tokens = budget_tokens
+        self.max_output_tokens = max_output_tokens
+        self.head_tokens = head_tokens
+        self.tail_tokens = tail_tokens
+        self.messages = []
+        self.outputs = {}
+
+    def add_message(self, role, content):
+        content = content if isinstance(content, str) else str(content)
+        self.messages.append({"role": role, "content": content, "tokens": count_tokens(content)})
+
+    def add_tool_output(self, tool, args, output):
+        # Returns the id under which the full output can be retrieved
+        output_id = len(self.outputs) + 1
+        full = output if isinstance(output, str) else json.dumps(output, default=str)
+        self.outputs[output_id] = {"tool": tool, "args": args, "output": full}
+        content = f"Tool '{tool}' output #{output_id}: {self.compact_output(output_id)}"
+        self.messages.append({
+            "role": "assistant",
+            "content": content,
+            "tokens": count_tokens(content),
+            "output_id": output_id
+        })
+        return output_id
+
+    def compact_output(self, output_id):
+        # Head and tail of a large output, the full text stays retrievable
+        full = self.outputs[output_id]["output"]
+        if count_tokens(full) <= self.max_output_tokens:
+            return full
+        return head_tail(full, self.head_tokens, self.tail_tokens, f"; get_tool_output({output_id}) returns the rest")
+
+    def output_reference(self, message):
+        stored = self.outputs[message["output_id"]]
+        return (
+            f"Tool '{stored['tool']}' output #{message['output_id']} omitted "
+            f"({count_tokens(stored['output'])} tokens); call get_tool_output to retrieve it."
+        )
+
+    def outputs_summary(self, output_ids, budget_tokens=None):
+        # The tool outputs of the current turn for the next planning prompt. The
+        # newest keep their compact form; older ones collapse to a reference once
+        # the summary would exceed its budget (half the context budget by default)
+        budget = budget_tokens or self.budget_tokens // 2
+        lines = []
+        used = 0
+        for output_id in reversed(output_ids):
+            stored = self.outputs[output_id]
+            line = f"Tool: {stored['tool']}, Args: {stored['args']}, Output #{output_id}: {self.compact_output(output_id)}"
+            if used + count_tokens(line) > budget and lines:
+                line = f"Tool: {stored['tool']}, Args: {stored['args']}, {self.output_reference({'output_id': output_id})}"
+            lines.append(line)
+            used += count_tokens(line)
+        lines.reverse()
+        return "\n".join(lines)
+
+    def get_output(self, output_id, offset=0, max_tokens=None):
+        # A page of a stored output, starting at a character offset
+        try:
+            stored = self.outputs.get(int(output_id))
+        except (TypeError, ValueError):
+            stored = None
+        if stored is None:
+            return f"Error: no stored tool output #{output_id}"
+        limit = (max_tokens or self.max_output_tokens) * CHARS_PER_TOKEN
+        chunk = stored["output"][offset:offset + limit]
+        end = offset + len(chunk)
+        if end < len(stored["output"]):
+            chunk += f"\n...[more available, call again with offset={end}]"
+        return chunk
+
+    def history(self):
+        return [{"role": m["role"], "content": m["content"]} for m in self.messages]
+
+    def build(self, reserve_tokens=0):
+        # Newest messages are kept as they are; older tool outputs collapse to a
+        # reference and, if that is not enough, the oldest messages are dropped
+        budget = self.budget_tokens - reserve_tokens
+        kept = []
+        used = 0
+        for message in reversed(self.messages):
+            content = message["content"]
+            tokens = message["tokens"]
+            if used + tokens > budget and "output_id" in message:
+                content = self.output_reference(message)
+                tokens = count_tokens(content)
+            if used + tokens > budget and kept:
+                break
+            kept.append({"role": message["role"], "content": content})
+            used += tokens
+        kept.reverse()
+        return kept
+
+    def clear(self):
+        self.messages = []
+        self.outputs = {}
+
+    def snapshot(self):
+        # JSON-safe copy of the history and the stored tool outputs
+        return {
+            "messages": [dict(m) for m in self.messages],
+            "outputs": {str(output_id): stored for output_id, stored in self.outputs.items()}
+        }
+
+    def restore(self, snapshot):
+        self.messages = [dict(m) for m in snapshot.get("messages", [])]
+        self.outputs = {int(output_id): stored for output_id, stored in snapshot.get("outputs", {}).items()}
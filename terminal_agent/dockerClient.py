@@ -1,103 +1,599 @@
 import docker
 import os
+import codecs
+import collections
+import hashlib
+import io
+import json
+import logging
+import posixpath
+import queue
+import shlex
+import tarfile
+import threading
+import time
+import uuid
+from .mcpClient import default_cache_dir
+from .tracing import tracer
+from .workspaceManifest import WorkspaceManifest, scan_command
+from .execScheduler import scheduler as default_scheduler
+
+logger = logging.getLogger(__name__)
 
 # Create Docker client object in UI for agentic loop
 
+# Host directory mounted as pip's cache in every sandbox, so downloaded and
+# built wheels survive container recreation and are shared between sandboxes
+PIP_CACHE_DIR = os.path.join(default_cache_dir(), "pip")
+
+# Top-level entries of the base image; anything else under / belongs to the
+# workspace when execs run at / (the shared container)
+BASE_IMAGE_ENTRIES = {
+    ".dockerenv", "bin", "boot", "dev", "etc", "home", "lib", "lib32", "lib64", "libx32",
+    "media", "mnt", "opt", "proc", "root", "run", "sbin", "srv", "sys", "tmp", "usr", "var"
+}
+
+# Prints the requirements from argv that are not installed at a matching version
+REQUIREMENT_CHECK = """
+import json, sys
+from importlib import metadata
+from pip._vendor.packaging.requirements import Requirement
+unmet = []
+for spec in sys.argv[1:]:
+    try:
+        req = Requirement(spec)
+        ok = not req.url and not req.extras and req.specifier.contains(metadata.version(req.name), prereleases=True)
+    except Exception:
+        ok = False
+    if not ok:
+        unmet.append(spec)
+print(json.dumps(unmet))
+"""
+
+CPU_PERIOD = 100000
+
+def pip_cache_volumes(host_dir=PIP_CACHE_DIR):
+    os.makedirs(host_dir, exist_ok=True)
+    return {host_dir: {"bind": "/root/.cache/pip", "mode": "rw"}}
+
+def resource_limits(cpus=None, memory=None, pids=None):
+    # containers.run() arguments; memory like "2g", swap is not allowed on top of it.
+    # CPUs go in as a CFS quota (not nano_cpus) so container.update() can change them later,
+    # and are clamped to the host: Docker refuses a quota for more CPUs than it has
+    limits = {}
+    if cpus:
+        cpus = min(cpus, os.cpu_count() or cpus)
+        limits["cpu_period"] = CPU_PERIOD
+        limits["cpu_quota"] = int(cpus * CPU_PERIOD)
+    if memory:
+        limits["mem_limit"] = memory
+        limits["memswap_limit"] = memory
+    if pids:
+        limits["pids_limit"] = pids
+    return limits
+
+def expected_host_config(limits):
+    # NanoCpus is only set by containers started before quotas went in as cpu_quota
+    return {
+        "NanoCpus": None,
+        "CpuQuota": limits.get("cpu_quota"),
+        "Memory": docker.utils.parse_bytes(limits["mem_limit"]) if limits.get("mem_limit") else None,
+        "MemorySwap": docker.utils.parse_bytes(limits["memswap_limit"]) if limits.get("memswap_limit") else None,
+        "PidsLimit": limits.get("pids_limit")
+    }
+
+def normalize_limit(value):
+    return value if value and value > 0 else 0
+
+def matches_limits(container, limits):
+    # True when an existing container was started with these limits (0 / None / -1 = unlimited)
+    host_config = container.attrs.get("HostConfig", {})
+    return all(normalize_limit(host_config.get(key)) == normalize_limit(value)
+               for key, value in expected_host_config(limits).items())
+
+def limit_update(container, limits):
+    # container.update() arguments that move a running container to these limits, or None when
+    # that can't be done in place (docker-py can't update pids, and a memory limit can't be lifted)
+    host_config = container.attrs.get("HostConfig", {})
+    expected = expected_host_config(limits)
+    if normalize_limit(host_config.get("PidsLimit")) != normalize_limit(expected["PidsLimit"]):
+        return None
+    if host_config.get("NanoCpus") or (normalize_limit(host_config.get("Memory")) and not expected["Memory"]):
+        return None
+    update = {"cpu_period": CPU_PERIOD, "cpu_quota": limits.get("cpu_quota") or -1}
+    if limits.get("mem_limit"):
+        update["mem_limit"] = limits["mem_limit"]
+        update["memswap_limit"] = limits["memswap_limit"]
+    return update
+
 class DockerExecution:
 
-    def __init__(self):
-        self.client = client = docker.from_env()
+    def __init__(self, run_timeout=120, install_timeout=600, shell_timeout=60, max_output_bytes=1024 * 1024, pool=None,
+                 image="python:3.10-slim", run_cache=None, limits=None, scheduler=None, fresh=False):
+        self.client = client = pool.client if pool else docker.from_env()
         self.container = None
+        # image for the fixed-name container, e.g. a committed session image
+        self.image = image
+        # CPU / memory / pids quotas (see resource_limits); a pool applies its own
+        self.limits = limits or {}
+        # host-wide cap on concurrent runs and pip installs
+        self.scheduler = scheduler or default_scheduler
+        # with a SandboxPool, sandboxes are leased instead of using the fixed-name container
+        self.pool = pool
+        # never reuse a running fixed-name container (resuming a session must start from what was saved)
+        self.fresh = fresh
+        # requirement strings known to be installed, per container id
+        self.satisfied_requirements = {}
+        # opt-in memo of run_file results (a RunCache), and the pip freeze hash it keys on, per container id
+        self.run_cache = run_cache
+        self.package_fingerprints = {}
+        # wall-clock limits (seconds) for execs, and how much output is kept per exec
+        self.run_timeout = run_timeout
+        self.install_timeout = install_timeout
+        self.shell_timeout = shell_timeout
+        self.max_output_bytes = max_output_bytes
+        # python:3.10-slim sets no WORKDIR, so execs (and relative paths) start at /
+        self.workdir = "/"
+        # path / size / mtime / hash of the workspace files, rescanned only after runs
+        self.manifest = WorkspaceManifest()
+        # tool calls run in parallel threads; scans and change hand-outs go one at a time
+        self.manifest_lock = threading.RLock()
 
     def list_files(self):
+        # Manifest entries ({"path", "size", "mtime", "hash"}), sorted by path
         if not self.container:
             raise RuntimeError("Container not started. Call start_container() first.")
-        
-        # listing files
-        exec_result = self.container.exec_run(f"ls")
-        return exec_result.output.decode('utf-8')
+        with self.manifest_lock:
+            self.refresh_manifest()
+            return self.manifest.listing()
+
+    def refresh_manifest(self):
+        with self.manifest_lock:
+            self._refresh_manifest()
+
+    def _refresh_manifest(self):
+        if not self.manifest.needs_scan(self.container.id):
+            return
+        skip = BASE_IMAGE_ENTRIES if self.workdir == "/" else ()
+        with tracer.span("docker.scan_workspace") as span:
+            # the first scan of a container for this manifest must list every file
+            fresh = self.manifest.container_id != self.container.id
+            exec_result = self.container.exec_run(scan_command(self.workdir, skip, self.manifest.max_files, fresh=fresh))
+            output = exec_result.output.decode('utf-8', errors='replace').strip()
+            if exec_result.exit_code != 0:
+                raise RuntimeError(f"Workspace scan failed: {output[-500:]}")
+            result = json.loads(output.splitlines()[-1])
+            span.set(changed=len(result["changed"]), removed=len(result["removed"]), full=result["full"])
+        self.manifest.apply_scan(result, self.container.id)
+
+    def workspace_changes(self):
+        # Files added, modified or removed since the previous call
+        if not self.container:
+            raise RuntimeError("Container not started. Call start_container() first.")
+        with self.manifest_lock:
+            self.refresh_manifest()
+            return self.manifest.take_changes()
 
     def start_container(self):
+        with tracer.span("docker.start_container", pooled=self.pool is not None):
+            self._start_container()
+
+    def _start_container(self):
+        if self.pool is not None:
+            if not self.container:
+                self.container = self.pool.lease()
+                self.workdir = self.pool.workdir
+            return
         # checks if already exists
         try:
             existing_container = self.client.containers.get("terminal-agent-container")
             
-            if existing_container.status == "running":
+            running = existing_container.status == "running"
+            reusable = running and not self.fresh and existing_container.attrs["Config"]["Image"] == self.image
+            if reusable and not matches_limits(existing_container, self.limits):
+                # new quotas are applied to the running sandbox, keeping its installed packages
+                update = limit_update(existing_container, self.limits)
+                if update is not None:
+                    try:
+                        existing_container.update(**update)
+                        existing_container.reload()
+                        logger.debug(f"Updated terminal-agent-container to limits {self.limits}")
+                    except docker.errors.APIError as e:
+                        logger.debug(f"Updating terminal-agent-container limits failed: {e}")
+            if reusable and matches_limits(existing_container, self.limits):
                 self.container = existing_container
             else:
-                print("Container exists but is not running. Removing and creating a new one.")
+                if running and self.fresh:
+                    logger.debug(f"Replacing terminal-agent-container with a fresh one from {self.image}")
+                elif running:
+                    logger.debug(f"Replacing terminal-agent-container to start from {self.image} with limits {self.limits}")
+                else:
+                    print("Container exists but is not running. Removing and creating a new one.")
                 existing_container.remove(force=True)
                 self.container = self.client.containers.run(
-                    image="python:3.10-slim",
+                    image=self.image,
                     command="sleep infinity",
                     detach=True,
                     tty=True,
                     name="terminal-agent-container",
-                    ports={'5000/tcp': 5001}
+                    ports={'5000/tcp': 5001},
+                    volumes=pip_cache_volumes(),
+                    **self.limits
                 )
         except docker.errors.NotFound:
             self.container = self.client.containers.run(
-                image="python:3.10-slim",
+                image=self.image,
                 command="sleep infinity",
                 detach=True,
                 tty=True,
-                name="terminal-agent-container"
+                name="terminal-agent-container",
+                volumes=pip_cache_volumes(),
+                **self.limits
             )
 
             # Add tool to install dependencies as well
 
+    def container_path(self, file_path):
+        # Relative paths are resolved against the working directory of execs
+        return posixpath.normpath(posixpath.join(self.workdir, file_path))
+
     def write_file(self, file_path, content):
+        self.write_files({file_path: content})
+        return 
+
+    def write_files(self, files):
+        # Writes {path: str | bytes} with a single in-memory tar and put_archive call
         if not self.container:
             raise RuntimeError("Container not started. Call start_container() first.")
-        
-        # base64 fixed quotation issues
-        import base64
-        encoded_content = base64.b64encode(content.encode('utf-8')).decode('utf-8')
-        
-        # Create the file using base64 decoding because it didn't work without for some reason
-        cmd = f'bash -c "echo {encoded_content} | base64 -d > {file_path}"'
-        exit_code, output = self.container.exec_run(cmd)
-        
-        if exit_code != 0:
-            raise RuntimeError(f"Failed to write file: {output.decode('utf-8')}")
-        
-        return 
-    
-    def run_file(self, file_name):
+        buffer = io.BytesIO()
+        now = time.time()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for file_path, content in files.items():
+                data = content.encode('utf-8') if isinstance(content, str) else content
+                info = tarfile.TarInfo(self.container_path(file_path).lstrip("/"))
+                info.size = len(data)
+                info.mode = 0o644
+                info.mtime = now
+                tar.addfile(info, io.BytesIO(data))
+        # missing parent directories are created by the daemon while extracting
+        with tracer.span("docker.write_files", files=len(files), bytes=buffer.tell()):
+            if not self.container.put_archive("/", buffer.getvalue()):
+                raise RuntimeError(f"Failed to write files: {', '.join(files)}")
+        with self.manifest_lock:
+            for file_path, content in files.items():
+                path = posixpath.relpath(self.container_path(file_path), self.workdir)
+                if not path.startswith(".."):
+                    self.manifest.record_write(path, content.encode('utf-8') if isinstance(content, str) else content)
+
+    def read_file(self, file_path, binary=False):
+        content = self.read_files([file_path], binary=binary)[file_path]
+        if content is None:
+            raise RuntimeError(f"File not found: {file_path}")
+        return content
+
+    def read_files(self, file_paths, binary=False):
+        # {path: content} via get_archive, None for files that don't exist; directories raise
+        if not self.container:
+            raise RuntimeError("Container not started. Call start_container() first.")
+        contents = {}
+        with tracer.span("docker.read_files", files=len(file_paths)):
+            for file_path in file_paths:
+                try:
+                    stream, stat = self.container.get_archive(self.container_path(file_path))
+                except docker.errors.NotFound:
+                    contents[file_path] = None
+                    continue
+                with tarfile.open(fileobj=io.BytesIO(b"".join(stream)), mode="r") as tar:
+                    # the first member is the path itself; a directory's archive holds its files too
+                    member = tar.next()
+                    if member is not None and member.isdir():
+                        raise RuntimeError(f"Not a file: {file_path}")
+                    data = tar.extractfile(member).read() if member is not None and member.isfile() else None
+                if data is not None and not binary:
+                    data = data.decode('utf-8', errors='replace')
+                contents[file_path] = data
+        return contents
+
+    def iter_exec(self, cmd, timeout=None, cancel_event=None, max_output_bytes=None):
+        # Yields ("stdout", text) / ("stderr", text) as the process writes them and
+        # finally ("result", {...}). On timeout or cancel the process tree is killed.
+        if not self.container:
+            raise RuntimeError("Container not started. Call start_container() first.")
+        if isinstance(cmd, str):
+            cmd = shlex.split(cmd)
+        max_output_bytes = max_output_bytes or self.max_output_bytes
+        marker = uuid.uuid4().hex
+        api = self.client.api
+        exec_id = api.exec_create(
+            self.container.id, cmd, stdout=True, stderr=True, workdir=self.workdir,
+            # there is no TTY, so Python would block-buffer stdout: nothing streams until
+            # ~8 KB piled up, and whatever is buffered is lost when a timeout kills it
+            environment={"TERMINAL_AGENT_EXEC": marker, "PYTHONUNBUFFERED": "1"}
+        )["Id"]
+
+        chunks = queue.Queue()
+
+        def read_output():
+            try:
+                for stdout, stderr in api.exec_start(exec_id, stream=True, demux=True):
+                    if stdout:
+                        chunks.put(("stdout", stdout))
+                    if stderr:
+                        chunks.put(("stderr", stderr))
+            except Exception as e:
+                chunks.put(("error", str(e).encode("utf-8")))
+            finally:
+                chunks.put(None)
+
+        started = time.monotonic()
+        threading.Thread(target=read_output, daemon=True).start()
+        decoders = {
+            "stdout": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+            "stderr": codecs.getincrementaldecoder("utf-8")(errors="replace")
+        }
+        head, tail = [], collections.deque()
+        head_bytes = tail_bytes = dropped_bytes = 0
+        half = max_output_bytes // 2
+        timed_out = cancelled = False
+        killed_at = None
+
+        while True:
+            try:
+                item = chunks.get(timeout=0.1)
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                stream, data = item
+                if stream == "error":
+                    stream = "stderr"
+                text = decoders[stream].decode(data)
+                yield stream, text
+                # keep the head and tail of large outputs, drop the middle
+                if head_bytes < half:
+                    head.append(text)
+                    head_bytes += len(data)
+                else:
+                    tail.append((text, len(data)))
+                    tail_bytes += len(data)
+                    while tail_bytes > half and len(tail) > 1:
+                        _, size = tail.popleft()
+                        tail_bytes -= size
+                        dropped_bytes += size
+            if killed_at is None:
+                if cancel_event is not None and cancel_event.is_set():
+                    cancelled = True
+                elif timeout is not None and time.monotonic() - started > timeout:
+                    timed_out = True
+                if timed_out or cancelled:
+                    self.kill_exec(marker)
+                    killed_at = time.monotonic()
+            elif time.monotonic() - killed_at > 5:
+                # the stream did not close after the kill; stop waiting for it
+                break
+
+        for stream, decoder in decoders.items():
+            rest = decoder.decode(b"", final=True)
+            if rest:
+                yield stream, rest
+                tail.append((rest, len(rest)))
+
+        output = "".join(head)
+        if dropped_bytes:
+            output += f"\n...[{dropped_bytes} bytes of output truncated]...\n"
+        output += "".join(text for text, _ in tail)
+        if timed_out:
+            output += f"\n[Process killed after exceeding the {timeout}s timeout]"
+        elif cancelled:
+            output += "\n[Process killed: cancelled by user]"
+        exit_code = api.exec_inspect(exec_id).get("ExitCode")
+        yield "result", {
+            'exit_code': exit_code if exit_code is not None else -1,
+            'output': output,
+            'duration': round(time.monotonic() - started, 3),
+            'timed_out': timed_out,
+            'cancelled': cancelled,
+            'truncated': dropped_bytes > 0
+        }
+
+    def kill_exec(self, marker):
+        # Every process started by the exec inherits TERMINAL_AGENT_EXEC=<marker>
+        script = (
+            "for d in /proc/[0-9]*; do "
+            f"grep -qa 'TERMINAL_AGENT_EXEC={marker}' $d/environ 2>/dev/null && kill -KILL ${{d#/proc/}} 2>/dev/null; "
+            "done; true"
+        )
+        self.container.exec_run(["sh", "-c", script])
+
+    def exec_command(self, cmd, timeout=None, cancel_event=None, on_output=None):
+        # Runs iter_exec to completion, passing each chunk to on_output(stream, text)
+        result = None
+        command = cmd if isinstance(cmd, str) else " ".join(cmd)
+        with tracer.span("docker.exec", command=command[:200]) as span:
+            for stream, value in self.iter_exec(cmd, timeout=timeout, cancel_event=cancel_event):
+                if stream == "result":
+                    result = value
+                elif on_output is not None:
+                    on_output(stream, value)
+            span.set(**{k: result[k] for k in ("exit_code", "timed_out", "cancelled", "truncated")})
+        return result
+
+    def scheduled_exec(self, kind, cmd, timeout=None, cancel_event=None, on_output=None):
+        # exec_command once the scheduler hands out a slot; the timeout starts then
+        with self.scheduler.slot(self, kind, cancel_event=cancel_event) as granted:
+            if not granted:
+                return {
+                    'exit_code': -1,
+                    'output': "[Process not started: cancelled while waiting for an exec slot]",
+                    'duration': 0.0,
+                    'timed_out': False,
+                    'cancelled': True,
+                    'truncated': False
+                }
+            result = self.exec_command(cmd, timeout=timeout, cancel_event=cancel_event, on_output=on_output)
+        if result['exit_code'] == 137 and self.limits.get("mem_limit") and not (result['timed_out'] or result['cancelled']):
+            result['output'] += f"\n[Process killed: probably exceeded the sandbox memory limit of {self.limits['mem_limit']}]"
+        return result
+
+    def run_file(self, file_name, timeout=None, cancel_event=None, on_output=None):
         if not self.container:
             raise RuntimeError("Container not started. Call start_container() first.")
         
         if file_name.endswith('.py'):
-            cmd = f"python {file_name}"
+            cmd = ["python", "-u", file_name]
         else:
-            cmd = f"./{file_name}"
+            cmd = [f"./{file_name}"]
         
-        exit_code, output = self.container.exec_run(cmd)
-        
-        return {
-            'exit_code': exit_code,
-            'output': output.decode('utf-8')
-        }
+        key = self.run_cache_key(file_name) if self.run_cache is not None else None
+        if key is not None:
+            before = self.workspace_hashes()
+            cached = self.run_cache.get(key)
+            if cached is not None:
+                cached['cached'] = True
+                cached['output'] = f"[cached: identical script, workspace and packages as an earlier run]\n{cached['output']}"
+                if on_output is not None:
+                    on_output("stdout", cached['output'])
+                return cached
+        try:
+            result = self.scheduled_exec("run", cmd, timeout=timeout or self.run_timeout, cancel_event=cancel_event, on_output=on_output)
+        finally:
+            # set after the run, so a scan that ran meanwhile can't clear it; the next query rescans
+            self.manifest.dirty = True
+        # a hit can't reproduce files the run wrote, so only runs that left the workspace as it was are kept
+        if key is not None and self.workspace_hashes() == before:
+            self.run_cache.put(key, result)
+        elif key is not None:
+            logger.debug(f"Not caching the run of {file_name}: it changed the workspace")
+        return result
+
+    def workspace_hashes(self):
+        with self.manifest_lock:
+            self.refresh_manifest()
+            return {path: entry["hash"] for path, entry in self.manifest.entries.items()}
+
+    def run_cache_key(self, file_name):
+        # None when this run must not be served from or stored in the cache
+        try:
+            content = self.read_files([file_name], binary=True)[file_name]
+        except RuntimeError:
+            # e.g. a package directory run through its __main__.py
+            return None
+        if content is None or not self.run_cache.cacheable(file_name, content):
+            return None
+        self.refresh_manifest()
+        if self.manifest.truncated:
+            return None
+        workspace = [[path, entry["hash"]] for path, entry in sorted(self.manifest.entries.items())]
+        return self.run_cache.key(self.image, self.workdir, file_name, workspace, self.package_fingerprint())
 
-    def install_dependency(self, dependency):
+    def package_fingerprint(self):
+        # pip freeze is only re-read after installs and shell commands
+        if self.container.id not in self.package_fingerprints:
+            freeze = "\n".join(sorted(self.installed_requirements()))
+            self.package_fingerprints[self.container.id] = hashlib.sha256(freeze.encode('utf-8')).hexdigest()
+        return self.package_fingerprints[self.container.id]
+
+    def install_dependency(self, dependency, timeout=None, cancel_event=None, on_output=None):
+        # split so several or quoted dependencies work (e.g., 'pandas==1.5.0 numpy')
+        return self.install_dependencies(shlex.split(dependency), timeout=timeout, cancel_event=cancel_event, on_output=on_output)
+
+    def unmet_requirements(self, requirements):
+        # One exec that checks installed versions against the specifiers
+        result = self.exec_command(["python", "-c", REQUIREMENT_CHECK, *requirements], timeout=self.shell_timeout)
+        try:
+            return json.loads(result['output'].strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            return list(requirements)
+
+    def invalidate_packages(self):
+        # pip may have changed anything: forget the fingerprint and what was known to be installed
+        self.package_fingerprints.pop(self.container.id, None)
+        self.satisfied_requirements.pop(self.container.id, None)
+
+    def install_dependencies(self, requirements, timeout=None, cancel_event=None, on_output=None):
+        # Skips pip entirely when everything is already installed, and installs
+        # the rest in a single pip call
         if not self.container:
             raise RuntimeError("Container not started. Call start_container() first.")
-        # Use bash -c to allow quoted dependencies (e.g., 'pandas==1.5.0')
-        cmd = f"pip install {dependency}"
-        exit_code, output = self.container.exec_run(cmd)
-        return {
-            'exit_code': exit_code,
-            'output': output.decode('utf-8')
-        }
+        satisfied = self.satisfied_requirements.setdefault(self.container.id, set())
+        if any(r.startswith("-") for r in requirements):
+            # pip options (e.g. --upgrade) always go to pip
+            to_install = list(requirements)
+        else:
+            to_install = [r for r in dict.fromkeys(requirements) if r not in satisfied]
+            if to_install:
+                to_install = self.unmet_requirements(to_install)
+        skipped = [r for r in requirements if r not in to_install]
+        if not to_install:
+            satisfied.update(requirements)
+            return {
+                'exit_code': 0,
+                'output': f"Requirement already satisfied: {', '.join(skipped)} (pip skipped)",
+                'skipped': skipped
+            }
+        cmd = ["pip", "install", *to_install]
+        self.invalidate_packages()
+        result = self.scheduled_exec("install", cmd, timeout=timeout or self.install_timeout, cancel_event=cancel_event, on_output=on_output)
+        if result['exit_code'] == 0:
+            self.satisfied_requirements.setdefault(self.container.id, set()).update(r for r in requirements if not r.startswith("-"))
+        if skipped:
+            result['output'] = f"Requirement already satisfied: {', '.join(skipped)}\n" + result['output']
+        result['skipped'] = skipped
+        return result
 
-    def end_container(self):
-        pass
+    def workspace_entries(self):
+        result = self.container.exec_run(["ls", "-A", self.workdir])
+        entries = result.output.decode('utf-8').split()
+        if self.workdir == "/":
+            entries = [e for e in entries if e not in BASE_IMAGE_ENTRIES]
+        return entries
 
-    def run_shell_command(self, command):
+    def export_workspace(self):
+        # Gzipped tar of the workspace, member paths relative to the working directory
         if not self.container:
             raise RuntimeError("Container not started. Call start_container() first.")
-        exit_code, output = self.container.exec_run(command)
-        return {
-            'exit_code': exit_code,
-            'output': output.decode('utf-8')
-        }
+        buffer = io.BytesIO()
+        with tracer.span("docker.export_workspace") as span:
+            with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+                for entry in self.workspace_entries():
+                    stream, stat = self.container.get_archive(posixpath.join(self.workdir, entry))
+                    with tarfile.open(fileobj=io.BytesIO(b"".join(stream)), mode="r") as tar:
+                        for member in tar.getmembers():
+                            archive.addfile(member, tar.extractfile(member) if member.isfile() else None)
+            span.set(bytes=buffer.tell())
+        return buffer.getvalue()
+
+    def import_workspace(self, data):
+        # The daemon unpacks gzipped tars itself
+        if not self.container:
+            raise RuntimeError("Container not started. Call start_container() first.")
+        with tracer.span("docker.import_workspace", bytes=len(data)):
+            # a workdir from another kind of sandbox (e.g. a pool's /workspace) may not exist here
+            exit_code, output = self.container.exec_run(["mkdir", "-p", self.workdir])
+            if exit_code != 0:
+                raise RuntimeError(f"Failed to create {self.workdir}: {output.decode('utf-8', errors='replace')}")
+            if not self.container.put_archive(self.workdir, data):
+                raise RuntimeError("Failed to restore the workspace")
+        self.manifest.dirty = True
+
+    def installed_requirements(self):
+        # name==version for everything pip installed (editable and URL installs are left out)
+        result = self.exec_command(["pip", "freeze", "--exclude-editable"], timeout=self.shell_timeout)
+        return [line for line in result['output'].splitlines() if "==" in line and " @ " not in line]
+
+    def end_container(self, refill=True):
+        # pooled sandboxes go back to the pool, which resets them; refill=False
+        # when no further sandbox will be leased (quitting, last batch task done)
+        if self.pool is not None and self.container:
+            self.pool.release(self.container, refill=refill)
+            self.container = None
+
+    def run_shell_command(self, command, timeout=None, cancel_event=None, on_output=None):
+        if not self.container:
+            raise RuntimeError("Container not started. Call start_container() first.")
+        self.invalidate_packages()
+        try:
+            return self.exec_command(command, timeout=timeout or self.shell_timeout, cancel_event=cancel_event, on_output=on_output)
+        finally:
+            self.manifest.dirty = True
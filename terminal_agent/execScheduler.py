@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from .mcpClient import default_cache_dir
+from .tracing import tracer
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Caps how many heavy execs (script runs, pip installs) run at once on this
+# host. Within a process, waiting execs queue per sandbox and slots are handed
+# out round-robin between sandboxes, so one session with many queued runs
+# can't starve the others. Across processes (separate TUI sessions, batch
+# runs) a granted exec also takes one of max_concurrent lock files under
+# <cache>/exec-slots; without fcntl (Windows) the cap is per process only.
+# Queue depth and wait times are in stats(), and every wait is a
+# "scheduler.wait" span.
+
+class ExecScheduler:
+
+    def __init__(self, max_concurrent=None, max_waits=1000, lock_dir=None):
+        self.max_concurrent = max_concurrent or os.cpu_count() or 4
+        # host-wide slots are flock()ed files in lock_dir
+        self.lock_dir = (lock_dir or os.path.join(default_cache_dir(), "exec-slots")) if fcntl else None
+        self.running = 0
+        self.granted = 0
+        self.cancelled = 0
+        self.waits = deque(maxlen=max_waits)
+        # sandbox -> FIFO of waiting tickets; the next slot goes to the first sandbox, which then moves to the end
+        self.queues = OrderedDict()
+        self._condition = threading.Condition()
+
+    def configure(self, max_concurrent):
+        with self._condition:
+            self.max_concurrent = max_concurrent or os.cpu_count() or 4
+            self._dispatch()
+
+    def _dispatch(self):
+        while self.running < self.max_concurrent and self.queues:
+            owner, tickets = next(iter(self.queues.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                self.queues.move_to_end(owner)
+            else:
+                del self.queues[owner]
+            ticket["granted"] = True
+            self.running += 1
+            self.granted += 1
+        self._condition.notify_all()
+
+    def _remove(self, owner, ticket):
+        # by identity: two waiting tickets of the same kind compare equal as dicts
+        tickets = self.queues.get(owner)
+        position = next((i for i, queued in enumerate(tickets or ()) if queued is ticket), None)
+        if position is not None:
+            del tickets[position]
+            if not tickets:
+                del self.queues[owner]
+
+    def _host_slot(self, cancel_event=None):
+        # An open, locked slot file; True when there are no host-wide slots, None if cancelled
+        if self.lock_dir is None:
+            return True
+        try:
+            os.makedirs(self.lock_dir, exist_ok=True)
+        except OSError as e:
+            logger.debug(f"No host-wide exec slots in {self.lock_dir}: {e}")
+            return True
+        while True:
+            for index in range(self.max_concurrent):
+                handle = open(os.path.join(self.lock_dir, f"slot-{index}.lock"), "a")
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return handle
+                except BlockingIOError:
+                    handle.close()
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            time.sleep(0.1)
+
+    def _release_host_slot(self, handle):
+        if handle is True:
+            return
+        fcntl.flock(handle, fcntl.LOCK_UN)
+        handle.close()
+
+    @contextmanager
+    def slot(self, owner, kind, cancel_event=None):
+        # Yields True once a slot is held, or False if cancel_event was set while queued
+        ticket = {"kind": kind, "granted": False}
+        started = time.perf_counter()
+        with tracer.span("scheduler.wait", kind=kind) as span:
+            with self._condition:
+                self.queues.setdefault(owner, deque()).append(ticket)
+                span.set(queued=self.queue_depth())
+                self._dispatch()
+                while not ticket["granted"]:
+                    if cancel_event is not None and cancel_event.is_set():
+                        self._remove(owner, ticket)
+                        self.cancelled += 1
+                        break
+                    self._condition.wait(timeout=0.1)
+            host_slot = None
+            if ticket["granted"]:
+                # other agent processes may hold the host's slots
+                host_slot = self._host_slot(cancel_event)
+                if host_slot is None:
+                    ticket["granted"] = False
+                    with self._condition:
+                        self.running -= 1
+                        self.cancelled += 1
+                        self._dispatch()
+            waited = time.perf_counter() - started
+            span.set(granted=ticket["granted"])
+        if not ticket["granted"]:
+            yield False
+            return
+        self.waits.append(waited)
+        if waited > 1:
+            logger.debug(f"{kind} exec waited {waited:.2f}s for a slot")
+        try:
+            yield True
+        finally:
+            self._release_host_slot(host_slot)
+            with self._condition:
+                self.running -= 1
+                self._dispatch()
+
+    def queue_depth(self):
+        return sum(len(tickets) for tickets in self.queues.values())
+
+    def stats(self):
+        with self._condition:
+            waits = sorted(self.waits)
+            by_kind = {}
+            for tickets in self.queues.values():
+                for ticket in tickets:
+                    by_kind[ticket["kind"]] = by_kind.get(ticket["kind"], 0) + 1
+            return {
+                "max_concurrent": self.max_concurrent,
+                "host_wide": self.lock_dir is not None,
+                "running": self.running,
+                "queued": self.queue_depth(),
+                "queued_by_kind": by_kind,
+                "waiting_sandboxes": len(self.queues),
+                "granted": self.granted,
+                "cancelled": self.cancelled,
+                "wait_p50": waits[len(waits) // 2] if waits else None,
+                "wait_p95": waits[min(int(len(waits) * 0.95), len(waits) - 1)] if waits else None,
+                "wait_max": waits[-1] if waits else None
+            }
+
+scheduler = ExecScheduler()
@@ -0,0 +1,150 @@
+import json
+import os
+from types import SimpleNamespace
+
+# Chat backends the agent can talk to. Both expose the same two calls:
+#   complete(model, **params) -> response with choices[0].message
+#   stream(model, **params)   -> async iterator of chunks with choices[0].delta
+# Provider errors are re-raised as LLMBackendError so callers don't depend on
+# a particular SDK.
+LLM_BACKENDS = ("groq", "openai")
+
+class LLMBackendError(RuntimeError):
+    pass
+
+def namespace_message(data):
+    return SimpleNamespace(
+        role=data.get("role", "assistant"),
+        content=data.get("content"),
+        tool_calls=[
+            SimpleNamespace(
+                id=tool_call.get("id"),
+                type="function",
+                function=SimpleNamespace(
+                    name=tool_call["function"].get("name"),
+                    arguments=tool_call["function"].get("arguments") or ""
+                )
+            )
+            for tool_call in data.get("tool_calls") or []
+        ] or None
+    )
+
+def namespace_chunk(data):
+    choices = []
+    for choice in data.get("choices") or []:
+        delta = choice.get("delta") or {}
+        choices.append(SimpleNamespace(
+            index=choice.get("index", 0),
+            finish_reason=choice.get("finish_reason"),
+            delta=SimpleNamespace(
+                content=delta.get("content"),
+                tool_calls=[
+                    SimpleNamespace(
+                        index=tool_call.get("index", 0),
+                        id=tool_call.get("id"),
+                        function=SimpleNamespace(
+                            name=(tool_call.get("function") or {}).get("name"),
+                            arguments=(tool_call.get("function") or {}).get("arguments")
+                        ) if tool_call.get("function") else None
+                    )
+                    for tool_call in delta.get("tool_calls") or []
+                ] or None
+            )
+        ))
+    return SimpleNamespace(choices=choices)
+
+class GroqBackend:
+    name = "groq"
+    default_model = "llama-3.3-70b-versatile"
+
+    def __init__(self, api_key=None):
+        import groq
+        self._errors = groq.APIError
+        self.client = groq.AsyncGroq(api_key=api_key) if api_key else groq.AsyncGroq()
+
+    async def complete(self, model, **params):
+        try:
+            return await self.client.chat.completions.create(model=model, **params)
+        except self._errors as e:
+            raise LLMBackendError(str(e)) from e
+
+    async def stream(self, model, **params):
+        try:
+            stream = await self.client.chat.completions.create(model=model, stream=True, **params)
+            async for chunk in stream:
+                yield chunk
+        except self._errors as e:
+            raise LLMBackendError(str(e)) from e
+
+    async def close(self):
+        await self.client.close()
+
+class OpenAICompatibleBackend:
+    # Any server speaking the OpenAI chat completions API (Cerebras, vLLM,
+    # llama.cpp, Ollama, the bundled stand-in server, ...)
+    name = "openai"
+    default_model = "llama-3.3-70b"
+
+    def __init__(self, base_url, api_key=None, timeout=120):
+        import httpx
+        self._httpx = httpx
+        self.base_url = base_url.rstrip("/")
+        api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.AsyncClient(base_url=self.base_url, headers=headers, timeout=timeout)
+
+    def _payload(self, model, params, stream):
+        payload = {"model": model, **params}
+        # OpenAI's name for the limit; most compatible servers accept both
+        if "max_completion_tokens" in payload:
+            payload.setdefault("max_tokens", payload["max_completion_tokens"])
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    async def complete(self, model, **params):
+        try:
+            response = await self.client.post("/chat/completions", json=self._payload(model, params, False))
+            response.raise_for_status()
+            data = response.json()
+        except (self._httpx.HTTPError, ValueError) as e:
+            raise LLMBackendError(f"{self.base_url}: {e}") from e
+        return SimpleNamespace(
+            choices=[
+                SimpleNamespace(
+                    index=choice.get("index", 0),
+                    message=namespace_message(choice.get("message") or {}),
+                    finish_reason=choice.get("finish_reason")
+                )
+                for choice in data.get("choices") or []
+            ],
+            usage=SimpleNamespace(**data["usage"]) if data.get("usage") else None
+        )
+
+    async def stream(self, model, **params):
+        try:
+            async with self.client.stream("POST", "/chat/completions", json=self._payload(model, params, True)) as response:
+                if response.status_code >= 400:
+                    body = (await response.aread()).decode("utf-8", errors="replace")
+                    raise LLMBackendError(f"{self.base_url}: HTTP {response.status_code}: {body[:500]}")
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    yield namespace_chunk(json.loads(data))
+        except (self._httpx.HTTPError, ValueError) as e:
+            raise LLMBackendError(f"{self.base_url}: {e}") from e
+
+    async def close(self):
+        await self.client.aclose()
+
+def make_backend(name="groq", base_url=None, api_key=None):
+    if name == "groq":
+        return GroqBackend(api_key=api_key)
+    if name == "openai":
+        if not base_url:
+            raise ValueError("The openai backend needs a base URL, e.g. http://localhost:8000/v1")
+        return OpenAICompatibleBackend(base_url, api_key=api_key)
+    raise ValueError(f"Unknown LLM backend: {name}")
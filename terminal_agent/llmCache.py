@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from types import SimpleNamespace
+from .mcpClient import default_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed cache of model responses, one JSON file per request hash.
+#   cache  - serve hits from disk, call the model and store on a miss
+#   record - always call the model and store the response (capture a session)
+#   replay - only serve from disk, a miss is an error (no network at all)
+LLM_CACHE_MODES = ("off", "cache", "record", "replay")
+
+class LLMCacheMiss(RuntimeError):
+    pass
+
+def message_to_dict(message):
+    return {
+        "content": message.content,
+        "tool_calls": [
+            {
+                "id": tool_call.id,
+                "type": "function",
+                "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments}
+            }
+            for tool_call in (message.tool_calls or [])
+        ] or None
+    }
+
+def message_from_dict(data):
+    return SimpleNamespace(
+        role="assistant",
+        content=data.get("content"),
+        tool_calls=[
+            SimpleNamespace(
+                id=tool_call["id"],
+                type="function",
+                function=SimpleNamespace(**tool_call["function"])
+            )
+            for tool_call in data.get("tool_calls") or []
+        ] or None
+    )
+
+def response_from_message(message):
+    # Same shape the agent reads from a chat completion response
+    return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")], usage=None)
+
+class LLMCache:
+
+    def __init__(self, mode="cache", path=None, max_bytes=256 * 1024 * 1024):
+        if mode not in LLM_CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode: {mode}")
+        self.mode = mode
+        self.path = path or os.path.join(default_cache_dir(), "llm")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._sizes = {}
+        if mode == "off":
+            return
+        os.makedirs(self.path, exist_ok=True)
+        self._sizes = {
+            entry.name: entry.stat().st_size
+            for entry in os.scandir(self.path) if entry.name.endswith(".json")
+        }
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def key(self, model, params):
+        # stream only changes how the answer is delivered, not what it is
+        request = {"model": model, **{k: v for k, v in params.items() if k != "stream"}}
+        encoded = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, model, params):
+        # Returns the cached message, None to go to the network, or raises in replay mode
+        if self.mode in ("off", "record"):
+            return None
+        file_name = f"{self.key(model, params)}.json"
+        file_path = os.path.join(self.path, file_name)
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(file_path)  # LRU: mtime is the last use
+        except (OSError, ValueError):
+            self.misses += 1
+            if self.mode == "replay":
+                raise LLMCacheMiss(f"No recorded response for request {file_name[:12]} (replay mode).")
+            return None
+        self.hits += 1
+        return message_from_dict(data["message"])
+
+    def put(self, model, params, message):
+        if self.mode not in ("cache", "record"):
+            return
+        file_name = f"{self.key(model, params)}.json"
+        encoded = json.dumps({"model": model, "message": message_to_dict(message)})
+        tmp_path = os.path.join(self.path, f".{file_name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(encoded)
+        os.replace(tmp_path, os.path.join(self.path, file_name))
+        with self._lock:
+            self._sizes[file_name] = len(encoded.encode("utf-8"))
+            self._evict()
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        by_age = []
+        for file_name in self._sizes:
+            try:
+                by_age.append((os.path.getmtime(os.path.join(self.path, file_name)), file_name))
+            except OSError:
+                by_age.append((0, file_name))
+        for _, file_name in sorted(by_age):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, file_name))
+            except OSError as e:
+                logger.debug(f"Failed to evict LLM cache entry {file_name}: {e}")
+            total -= self._sizes.pop(file_name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "entries": len(self._sizes),
+                "bytes": sum(self._sizes.values()),
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,188 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Offline stand-in for an OpenAI-compatible chat endpoint. Replies come from a
+# script so runs are repeatable, and latency is configurable so provider
+# speeds can be imitated. A script is a JSON list (or JSONL file) of replies:
+#   {"content": "text"}
+#   {"tool_calls": [{"name": "list_files", "arguments": {}}]}
+#   {"match": "pandas", "content": "..."}   rule, used whenever the last user
+#                                            message contains the text
+#   {"error": "overloaded", "status": 503}  provider failure
+#   "latency" / "token_delay" on an entry override the server defaults.
+# Entries without "match" are served in order; once they run out the server
+# answers with a short echo of the request.
+
+def load_script(path):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+class ScriptedReplies:
+    # Script bookkeeping and response shapes, shared by the HTTP server and
+    # the in-process benchmark backend
+
+    def __init__(self, script=None, latency=0.0, token_delay=0.0, chunk_chars=8, model="stand-in"):
+        self.rules = [entry for entry in script or [] if "match" in entry]
+        self.queue = [entry for entry in script or [] if "match" not in entry]
+        self.latency = latency
+        self.token_delay = token_delay
+        self.chunk_chars = chunk_chars
+        self.model = model
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def next_reply(self, request):
+        messages = request.get("messages") or []
+        last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        with self._lock:
+            self.requests.append(request)
+            for rule in self.rules:
+                if rule["match"] in last_user:
+                    return rule
+            if self.queue:
+                return self.queue.pop(0)
+        return {"content": f"stand-in reply to: {last_user[:200]}"}
+
+    def completion(self, request, reply):
+        tool_calls = [
+            {
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments", {}))}
+            }
+            for call in reply.get("tool_calls") or []
+        ]
+        message = {"role": "assistant", "content": reply.get("content")}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        prompt = json.dumps(request.get("messages") or [])
+        completion_tokens = estimate_tokens((reply.get("content") or "") + json.dumps(tool_calls))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model") or self.model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+            "usage": {
+                "prompt_tokens": estimate_tokens(prompt),
+                "completion_tokens": completion_tokens,
+                "total_tokens": estimate_tokens(prompt) + completion_tokens
+            }
+        }
+
+    def stream_chunks(self, completion):
+        # Content in chunk_chars pieces, then each tool call name and arguments
+        message = completion["choices"][0]["message"]
+        base = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"], "model": completion["model"]}
+        yield {**base, "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]}
+        content = message.get("content") or ""
+        for i in range(0, len(content), self.chunk_chars):
+            yield {**base, "choices": [{"index": 0, "delta": {"content": content[i:i + self.chunk_chars]}, "finish_reason": None}]}
+        for index, tool_call in enumerate(message.get("tool_calls") or []):
+            arguments = tool_call["function"]["arguments"]
+            yield {**base, "choices": [{"index": 0, "delta": {"tool_calls": [{
+                "index": index, "id": tool_call["id"], "type": "function",
+                "function": {"name": tool_call["function"]["name"], "arguments": ""}
+            }]}, "finish_reason": None}]}
+            for i in range(0, len(arguments), self.chunk_chars):
+                yield {**base, "choices": [{"index": 0, "delta": {"tool_calls": [{
+                    "index": index, "function": {"arguments": arguments[i:i + self.chunk_chars]}
+                }]}, "finish_reason": None}]}
+        yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": completion["choices"][0]["finish_reason"]}]}
+
+class LocalLLMServer(ScriptedReplies):
+
+    def __init__(self, script=None, latency=0.0, token_delay=0.0, chunk_chars=8,
+                 host="127.0.0.1", port=0, model="stand-in"):
+        super().__init__(script, latency=latency, token_delay=token_delay, chunk_chars=chunk_chars, model=model)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug(f"stand-in LLM server: {format % args}")
+
+            def send_json(self, status, body):
+                encoded = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self.send_json(200, {"object": "list", "data": [{"id": server.model, "object": "model"}]})
+                else:
+                    self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError as e:
+                    self.send_json(400, {"error": {"message": f"Invalid JSON body: {e}"}})
+                    return
+                reply = server.next_reply(request)
+                if "error" in reply:
+                    self.send_json(reply.get("status", 500), {"error": {"message": reply["error"]}})
+                    return
+                time.sleep(reply.get("latency", server.latency))
+                completion = server.completion(request, reply)
+                if not request.get("stream"):
+                    self.send_json(200, completion)
+                    return
+                token_delay = reply.get("token_delay", server.token_delay)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for i, chunk in enumerate(server.stream_chunks(completion)):
+                    if i and token_delay:
+                        time.sleep(token_delay)
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
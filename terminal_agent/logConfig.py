@@ -0,0 +1,94 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+# Logging for the terminal_agent package only (the root logger is left alone).
+# Records go through a QueueHandler so the event loop never waits on file I/O;
+# a QueueListener thread writes them to a size-rotated file. Large payloads
+# (e.g. full MCP responses) are cut down before they are queued.
+
+LOGGER_NAME = "terminal_agent"
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+_listener = None
+
+class PayloadFilter(logging.Filter):
+    # Truncates messages longer than max_chars; with sample_every=N only every
+    # Nth oversized record is kept at all (warnings and errors always are)
+
+    def __init__(self, max_chars=2000, sample_every=1):
+        super().__init__()
+        self.max_chars = max_chars
+        self.sample_every = max(sample_every, 1)
+        self.oversized = 0
+
+    def filter(self, record):
+        message = record.getMessage()
+        if not self.max_chars or len(message) <= self.max_chars:
+            return True
+        self.oversized += 1
+        if record.levelno < logging.WARNING and (self.oversized - 1) % self.sample_every:
+            return False
+        head = message[:self.max_chars]
+        record.msg = f"{head}...[{len(message) - self.max_chars} chars truncated]"
+        record.args = ()
+        return True
+
+def parse_module_levels(spec):
+    # "mcpClient=INFO,agent=DEBUG" -> {"terminal_agent.mcpClient": "INFO", ...}
+    levels = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, level = item.partition("=")
+        name = name.strip()
+        if not name.startswith(LOGGER_NAME):
+            name = f"{LOGGER_NAME}.{name}"
+        level = level.strip().upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level '{level}' for {name}")
+        levels[name] = level
+    return levels
+
+def setup_logging(path="agent_debug.log", level="DEBUG", module_levels=None,
+                  max_bytes=5 * 1024 * 1024, backup_count=3, max_chars=2000, sample_every=1):
+    # Safe to call again, e.g. with different options; the previous listener is stopped
+    global _listener
+    shutdown_logging()
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+    if not path:
+        logger.addHandler(logging.NullHandler())
+        return None
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(PayloadFilter(max_chars=max_chars, sample_every=sample_every))
+    logger.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def shutdown_logging():
+    # Flushes whatever is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+atexit.register(shutdown_logging)
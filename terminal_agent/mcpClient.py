@@ -0,0 +1,279 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+MCP_IMAGE = "ghcr.io/github/github-mcp-server"
+MCP_PROTOCOL_VERSION = "2024-11-05"
+
+# Long-lived stdio session with the GitHub MCP server.
+# One container is started, the initialize handshake is done once, and every
+# request gets its own JSON-RPC id so several can be in flight at once.
+
+class MCPError(RuntimeError):
+    pass
+
+class MCPConnectionLost(MCPError):
+    def __init__(self, message, sent=True):
+        super().__init__(message)
+        self.sent = sent
+
+class MCPSession:
+
+    def __init__(self, token, image=MCP_IMAGE, request_timeout=60, max_restarts=3):
+        if not token:
+            raise ValueError("You must provide a GitHub token for MCP server.")
+        self.token = token
+        self.image = image
+        self.request_timeout = request_timeout
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self.server_info = None
+        self.proc = None
+        self._pending = {}
+        self._next_id = 0
+        self._id_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._start_lock = threading.RLock()
+        self._closed = False
+
+    # process management
+
+    def _spawn(self):
+        env = dict(os.environ, GITHUB_PERSONAL_ACCESS_TOKEN=self.token)
+        proc = subprocess.Popen(
+            [
+                "docker", "run", "-i", "--rm",
+                "-e", "GITHUB_PERSONAL_ACCESS_TOKEN",
+                self.image
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            env=env
+        )
+        proc.stdout_closed = False
+        threading.Thread(target=self._read_stdout, args=(proc,), daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(proc,), daemon=True).start()
+        return proc
+
+    def _is_alive(self, proc):
+        return proc is not None and proc.poll() is None and not proc.stdout_closed
+
+    def ensure_started(self):
+        with self._start_lock:
+            if self._closed:
+                raise MCPError("MCP session is closed.")
+            if self._is_alive(self.proc):
+                return self.proc
+            if self.proc is not None:
+                if self.restarts >= self.max_restarts:
+                    raise MCPError(f"MCP server crashed {self.restarts} times, giving up.")
+                self.restarts += 1
+                logger.debug(f"MCP server exited (code {self.proc.poll()}), restarting ({self.restarts}/{self.max_restarts})")
+            with tracer.span("mcp.start", restarts=self.restarts):
+                self.proc = self._spawn()
+                try:
+                    self._handshake(self.proc)
+                except Exception:
+                    self.proc.kill()
+                    raise
+            return self.proc
+
+    def _handshake(self, proc):
+        result = self._request_on(proc, "initialize", {
+            "protocolVersion": MCP_PROTOCOL_VERSION,
+            "capabilities": {},
+            "clientInfo": {"name": "terminal-agent", "version": "0.1.0"}
+        })
+        self.server_info = result.get("serverInfo") if isinstance(result, dict) else None
+        self._write(proc, {"jsonrpc": "2.0", "method": "notifications/initialized"})
+        logger.debug(f"MCP session initialized: {self.server_info}")
+
+    # reader threads
+
+    def _read_stdout(self, proc):
+        for line in proc.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                logger.debug("MCP non-JSON output: %s", line)
+                continue
+            msg_id = message.get("id")
+            if msg_id is None or "method" in message:
+                # server notifications / requests, nothing to answer for now
+                logger.debug("MCP server message: %s", message)
+                continue
+            future = self._pending.pop(msg_id, None)
+            if future is not None and not future.done():
+                future.set_result(message)
+        proc.stdout_closed = True
+        self._fail_pending(proc, MCPConnectionLost("MCP server closed its stdout."))
+
+    def _read_stderr(self, proc):
+        for line in proc.stderr:
+            logger.debug(f"MCP stderr: {line.rstrip()}")
+
+    def _fail_pending(self, proc, exc):
+        for msg_id, future in list(self._pending.items()):
+            if future.proc is proc:
+                self._pending.pop(msg_id, None)
+                if not future.done():
+                    future.set_exception(exc)
+
+    # requests
+
+    def _new_id(self):
+        with self._id_lock:
+            self._next_id += 1
+            return self._next_id
+
+    def _write(self, proc, message):
+        with self._write_lock:
+            proc.stdin.write(json.dumps(message) + "\n")
+            proc.stdin.flush()
+
+    def _request_on(self, proc, method, params=None, timeout=None):
+        msg_id = self._new_id()
+        future = Future()
+        future.proc = proc
+        self._pending[msg_id] = future
+        if proc.stdout_closed:
+            self._pending.pop(msg_id, None)
+            raise MCPConnectionLost("MCP server closed its stdout.", sent=False)
+        message = {"jsonrpc": "2.0", "id": msg_id, "method": method}
+        if params is not None:
+            message["params"] = params
+        try:
+            self._write(proc, message)
+        except (BrokenPipeError, OSError, ValueError) as e:
+            self._pending.pop(msg_id, None)
+            raise MCPConnectionLost(f"Failed to write to MCP server: {e}", sent=False)
+        try:
+            response = future.result(timeout=timeout or self.request_timeout)
+        except FutureTimeoutError:
+            self._pending.pop(msg_id, None)
+            raise MCPError(f"MCP request '{method}' timed out.")
+        if method == "initialize":
+            if "error" in response:
+                raise MCPError(f"MCP initialize failed: {response['error']}")
+            return response.get("result")
+        return response
+
+    def request(self, method, params=None, timeout=None):
+        # Returns the raw JSON-RPC response. If the server died underneath us it is
+        # restarted and the request retried once, unless a tool call may already have run.
+        tool = (params or {}).get("name") if method == "tools/call" else None
+        with tracer.span("mcp.request", method=method, tool=tool) as span:
+            for attempt in range(2):
+                proc = self.ensure_started()
+                span.set(attempts=attempt + 1)
+                try:
+                    return self._request_on(proc, method, params, timeout)
+                except MCPConnectionLost as e:
+                    if attempt == 1 or (e.sent and method == "tools/call"):
+                        raise
+
+    def list_tools(self):
+        return self.request("tools/list")
+
+    def call_tool(self, name, arguments=None):
+        return self.request("tools/call", {"name": name, "arguments": arguments or {}})
+
+    def close(self, timeout=5):
+        with self._start_lock:
+            self._closed = True
+            proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.terminate()
+            try:
+                proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self._fail_pending(proc, MCPConnectionLost("MCP session closed."))
+
+
+def image_digest(image=MCP_IMAGE):
+    # Local image id of the MCP server, used to invalidate cached tool catalogs
+    try:
+        result = subprocess.run(
+            ["docker", "image", "inspect", "--format", "{{.Id}}", image],
+            capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.debug(f"Could not inspect MCP image {image}: {e}")
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or None
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "terminal-agent")
+
+
+class ToolCatalogCache:
+    # Converted MCP tool schemas on disk, one entry per server image digest
+
+    def __init__(self, path=None, ttl=24 * 60 * 60, image=MCP_IMAGE):
+        self.path = path or os.path.join(default_cache_dir(), "mcp_tools.json")
+        self.ttl = ttl
+        self.image = image
+        self._digest = None
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            # not kept while the image isn't pulled: fetching the catalog pulls it,
+            # and save() should then file the tools under the real digest
+            digest = image_digest(self.image)
+            if not digest:
+                return "unknown"
+            self._digest = digest
+        return self._digest
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def load(self):
+        # Returns (tools, is_stale) or (None, True) when nothing is cached for this image
+        entry = self._read().get(self.digest)
+        if not entry or not isinstance(entry.get("tools"), list):
+            return None, True
+        age = time.time() - entry.get("fetched_at", 0)
+        return entry["tools"], age > self.ttl
+
+    def save(self, tools):
+        # entries for older images are dropped
+        data = {}
+        data[self.digest] = {"image": self.image, "fetched_at": time.time(), "tools": tools}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
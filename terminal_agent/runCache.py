@@ -0,0 +1,81 @@
+import copy
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Opt-in memo of run_file results. The key covers the image, the working
+# directory, the file name, the hash of every workspace file (the script
+# included) and the installed package set, so a hit means the script would
+# run against exactly the same inputs. Scripts whose output varies anyway
+# (time, randomness, network) are kept out by mark_nondeterministic() or by a
+# "# terminal-agent: no-cache" comment in the script. Runs that changed the
+# workspace are not stored, since a hit can't recreate their files. Entries
+# are evicted least recently used first, by count and by total output size.
+
+NO_CACHE_PRAGMA = b"terminal-agent: no-cache"
+
+class RunCache:
+
+    def __init__(self, max_entries=64, max_bytes=8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.nondeterministic = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def key(self, image, workdir, file_name, workspace, packages):
+        payload = json.dumps([image, workdir, file_name, workspace, packages], separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def mark_nondeterministic(self, file_name):
+        with self._lock:
+            self.nondeterministic.add(file_name)
+
+    def cacheable(self, file_name, content):
+        return file_name not in self.nondeterministic and NO_CACHE_PRAGMA not in content
+
+    def get(self, key):
+        with self._lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(result)
+
+    def put(self, key, result):
+        # timed out or cancelled runs say nothing about the script, so they are not kept
+        if result.get('timed_out') or result.get('cancelled'):
+            return
+        size = len(result.get('output') or "")
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self.bytes -= len(self.entries.pop(key).get('output') or "")
+            self.entries[key] = copy.deepcopy(result)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted.get('output') or "")
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "nondeterministic": sorted(self.nondeterministic)
+            }
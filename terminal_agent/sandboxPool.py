@@ -0,0 +1,181 @@
+import docker
+import logging
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from .dockerClient import pip_cache_volumes
+
+logger = logging.getLogger(__name__)
+
+# Keeps N sandboxes pre-started from a committed baseline image and leases
+# them out one per session. Returned sandboxes are thrown away and replaced
+# by a fresh container from the snapshot in the background, which resets
+# files and installed packages without paying for a cold start.
+
+class SandboxPool:
+
+    def __init__(self, client=None, size=2, image="python:3.10-slim",
+                 snapshot_image="terminal-agent-baseline:latest", workdir="/workspace", limits=None):
+        self.client = client or docker.from_env()
+        self.size = size
+        self.image = image
+        self.snapshot_image = snapshot_image
+        self.workdir = workdir
+        # CPU / memory / pids quotas for every sandbox (dockerClient.resource_limits)
+        self.limits = limits or {}
+        self.pool_id = uuid.uuid4().hex[:8]
+        self.available = queue.Queue()
+        self.leased = {}
+        self.creating = 0
+        self.lease_waits = []
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(size, 1), thread_name_prefix="sandbox-pool")
+        self._closed = False
+
+    def start(self, rebuild_snapshot=False):
+        self.ensure_snapshot(rebuild=rebuild_snapshot)
+        for _ in range(self.size):
+            self._refill()
+
+    def ensure_snapshot(self, rebuild=False):
+        # Baseline = base image + workspace directory, committed once per host
+        if not rebuild:
+            try:
+                self.client.images.get(self.snapshot_image)
+                return
+            except docker.errors.ImageNotFound:
+                pass
+        container = self.client.containers.run(
+            image=self.image,
+            command="sleep infinity",
+            detach=True,
+            tty=True
+        )
+        try:
+            exit_code, output = container.exec_run(["mkdir", "-p", self.workdir])
+            if exit_code != 0:
+                raise RuntimeError(f"Failed to prepare baseline sandbox: {output.decode('utf-8')}")
+            repository, _, tag = self.snapshot_image.partition(":")
+            container.commit(repository=repository, tag=tag or "latest")
+        finally:
+            container.remove(force=True)
+        logger.debug(f"Committed sandbox baseline image {self.snapshot_image}")
+
+    def create_sandbox(self):
+        return self.client.containers.run(
+            image=self.snapshot_image,
+            command="sleep infinity",
+            detach=True,
+            tty=True,
+            working_dir=self.workdir,
+            name=f"terminal-agent-sandbox-{self.pool_id}-{uuid.uuid4().hex[:8]}",
+            labels={"terminal-agent.pool": self.pool_id},
+            volumes=pip_cache_volumes(),
+            **self.limits
+        )
+
+    def _refill(self):
+        with self._lock:
+            if self._closed:
+                return
+            self.creating += 1
+        self._executor.submit(self._create_into_pool)
+
+    def _create_into_pool(self):
+        error = None
+        try:
+            container = self.create_sandbox()
+        except Exception as e:
+            logger.debug(f"Failed to start pooled sandbox: {e}")
+            container = None
+            error = f"{type(e).__name__}: {e}"
+        with self._lock:
+            self.creating -= 1
+            closed = self._closed
+            # kept so lease() can fail instead of waiting for a sandbox that will never come
+            self.last_error = error
+        if container is None:
+            return
+        if closed:
+            self._remove(container)
+        else:
+            self.available.put(container)
+
+    def lease(self, timeout=None):
+        started = time.monotonic()
+        while True:
+            remaining = None if timeout is None else max(timeout - (time.monotonic() - started), 0)
+            try:
+                container = self.available.get(timeout=min(remaining, 0.2) if remaining is not None else 0.2)
+            except queue.Empty:
+                with self._lock:
+                    failed = self.creating == 0 and self.last_error is not None
+                    error = self.last_error
+                if failed and self.available.empty():
+                    # start a replacement for the next lease, but don't wait for it
+                    self._refill()
+                    raise RuntimeError(f"No sandbox available: starting one failed ({error})")
+                if remaining is not None and remaining <= 0.2:
+                    raise RuntimeError(f"No sandbox became available within {timeout}s.")
+                continue
+            container.reload()
+            if container.status == "running":
+                break
+            # died while waiting in the pool, replace it and try the next one
+            self._remove(container)
+            self._refill()
+        wait = time.monotonic() - started
+        with self._lock:
+            self.leased[container.id] = container
+            self.lease_waits.append(wait)
+        logger.debug(f"Leased sandbox {container.name} after {wait:.3f}s")
+        return container
+
+    def release(self, container, refill=True):
+        # Reset = drop the used sandbox and start a fresh one from the snapshot
+        with self._lock:
+            self.leased.pop(container.id, None)
+            closed = self._closed
+        if closed or not refill:
+            self._remove(container)
+            return
+        self._executor.submit(self._remove, container)
+        self._refill()
+
+    def _remove(self, container):
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError as e:
+            logger.debug(f"Failed to remove sandbox {container.name}: {e}")
+
+    def stats(self):
+        with self._lock:
+            waits = list(self.lease_waits)
+            return {
+                "size": self.size,
+                "available": self.available.qsize(),
+                "leased": len(self.leased),
+                "creating": self.creating,
+                "last_error": self.last_error,
+                "leases": len(waits),
+                "last_lease_wait": waits[-1] if waits else None,
+                "avg_lease_wait": sum(waits) / len(waits) if waits else None,
+                "max_lease_wait": max(waits) if waits else None
+            }
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            leased, self.leased = list(self.leased.values()), {}
+        for container in leased:
+            self._remove(container)
+        # in-flight creations see the pool closed and remove their container
+        self._executor.shutdown(wait=True)
+        while True:
+            try:
+                self._remove(self.available.get_nowait())
+            except queue.Empty:
+                break
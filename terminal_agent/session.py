@@ -0,0 +1,129 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from .mcpClient import default_cache_dir
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Saved sessions: the conversation (history plus stored tool outputs) as
+# gzipped JSON, and the sandbox either as a committed image ("image": files
+# and installed packages, restored by starting a container from it) or as a
+# workspace tarball plus a pip freeze ("tarball": portable, packages come
+# back through the shared pip cache). One directory per session:
+#   <cache>/sessions/<name>/session.json, conversation.json.gz[, workspace.tar.gz]
+
+SESSION_MODES = ("image", "tarball")
+SESSION_IMAGE = "terminal-agent-session"
+SESSION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+def sessions_dir():
+    return os.path.join(default_cache_dir(), "sessions")
+
+def session_path(name):
+    if not SESSION_NAME.match(name or ""):
+        raise ValueError(f"Invalid session name '{name}' (letters, digits, '.', '_' and '-' only)")
+    return os.path.join(sessions_dir(), name)
+
+def image_tag(name):
+    # image tags are lowercase; the hash keeps "Foo" and "foo" from sharing one
+    return f"{name.lower()}-{hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]}"
+
+def default_session_name():
+    return time.strftime("session-%Y%m%d-%H%M%S")
+
+def save_session(name, agent, docker_client, mode="image"):
+    if mode not in SESSION_MODES:
+        raise ValueError(f"Unknown session mode: {mode}")
+    path = session_path(name)
+    # on case-insensitive filesystems these would share a directory
+    if os.path.isdir(sessions_dir()):
+        for existing in os.listdir(sessions_dir()):
+            if existing != name and existing.lower() == name.lower():
+                raise ValueError(f"Session '{existing}' already exists; names may not differ only by case")
+    started = time.perf_counter()
+    with tracer.span("session.save", session=name, mode=mode) as span:
+        os.makedirs(path, exist_ok=True)
+        meta = {
+            "name": name,
+            "saved_at": time.time(),
+            "mode": mode,
+            "workdir": docker_client.workdir,
+            "planner_mode": agent.planner_mode,
+            "messages": len(agent.context.messages)
+        }
+        if mode == "image":
+            tag = image_tag(name)
+            docker_client.container.commit(repository=SESSION_IMAGE, tag=tag)
+            meta["image"] = f"{SESSION_IMAGE}:{tag}"
+        else:
+            with open(os.path.join(path, "workspace.tar.gz"), "wb") as f:
+                f.write(docker_client.export_workspace())
+            meta["requirements"] = docker_client.installed_requirements()
+        with gzip.open(os.path.join(path, "conversation.json.gz"), "wt", encoding="utf-8") as f:
+            json.dump(agent.context.snapshot(), f, separators=(",", ":"))
+        # written last, so a session without it never finished saving
+        with open(os.path.join(path, "session.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        meta["seconds"] = round(time.perf_counter() - started, 3)
+        span.set(seconds=meta["seconds"])
+    logger.debug(f"Saved session {name}: {meta}")
+    return meta
+
+def load_session(name):
+    # Metadata and conversation; the sandbox is restored by restore_sandbox
+    path = session_path(name)
+    try:
+        with open(os.path.join(path, "session.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"No saved session '{name}' in {sessions_dir()}")
+    with gzip.open(os.path.join(path, "conversation.json.gz"), "rt", encoding="utf-8") as f:
+        meta["conversation"] = json.load(f)
+    meta["path"] = path
+    return meta
+
+def restore_sandbox(session, docker_client):
+    # Call after start_container() on a fresh sandbox (DockerExecution(fresh=True) or a pooled one);
+    # for "image" sessions the client was created with the session image
+    with tracer.span("session.restore", session=session["name"], mode=session["mode"]):
+        docker_client.workdir = session["workdir"]
+        if session["mode"] != "tarball":
+            return
+        with open(os.path.join(session["path"], "workspace.tar.gz"), "rb") as f:
+            docker_client.import_workspace(f.read())
+        if session.get("requirements"):
+            # already-installed ones are skipped, the rest come from the pip cache
+            result = docker_client.install_dependencies(session["requirements"])
+            if result['exit_code'] != 0:
+                logger.debug(f"Restoring packages for session {session['name']} failed: {result['output'][-2000:]}")
+
+def list_sessions():
+    sessions = []
+    if not os.path.isdir(sessions_dir()):
+        return sessions
+    for name in sorted(os.listdir(sessions_dir())):
+        try:
+            with open(os.path.join(sessions_dir(), name, "session.json"), "r", encoding="utf-8") as f:
+                sessions.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sessions
+
+def delete_session(name):
+    path = session_path(name)
+    meta = next((s for s in list_sessions() if s["name"] == name), None)
+    if meta is None:
+        raise ValueError(f"No saved session '{name}' in {sessions_dir()}")
+    if meta.get("image"):
+        import docker
+        try:
+            docker.from_env().images.remove(meta["image"])
+        except Exception as e:
+            logger.debug(f"Failed to remove session image {meta['image']}: {e}")
+    shutil.rmtree(path, ignore_errors=True)
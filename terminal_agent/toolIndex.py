@@ -0,0 +1,60 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+# BM25 index over tool names and descriptions, so prompts only list the tools
+# relevant to the current request instead of the whole MCP catalog.
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "the", "this", "to", "with", "you", "your", "me", "my", "i"
+}
+
+def tokenize(text):
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        if token in STOPWORDS:
+            continue
+        # crude plural folding: issues -> issue, files -> file
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+class ToolIndex:
+
+    def __init__(self, tools, k1=1.5, b=0.75, name_weight=2):
+        self.tools = list(tools)
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        for doc_id, tool in enumerate(self.tools):
+            function = tool["function"]
+            # name terms count extra, they are the strongest signal
+            terms = tokenize(function["name"].replace("_", " ")) * name_weight + tokenize(function.get("description", ""))
+            self.doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings[term].append((doc_id, tf))
+        count = len(self.tools)
+        self.avg_length = sum(self.doc_lengths) / count if count else 0
+        self.idf = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def scores(self, query):
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_length or 1)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores
+
+    def search(self, query, k):
+        # Top-k tools with a non-zero score, best first
+        ranked = sorted(self.scores(query).items(), key=lambda item: item[1], reverse=True)
+        return [self.tools[doc_id] for doc_id, _ in ranked[:k]]
@@ -0,0 +1,190 @@
+import inspect
+import re
+
+# Name -> (schema, handler, validator) registry for everything the model can
+# call. Local tools are declared with the @tool decorator on AIAgent methods,
+# MCP tools are registered from their inputSchema. Validators are compiled
+# once per tool, so a malformed call is rejected before any Docker or MCP work.
+
+JSON_TYPES = {
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "null": lambda v: v is None
+}
+
+def compile_schema(schema):
+    # Returns check(value, path) -> list of error strings. Keywords that are
+    # not handled here are ignored rather than rejected.
+    if not isinstance(schema, dict) or not schema:
+        return lambda value, path: []
+    checks = []
+
+    types = schema.get("type")
+    if types:
+        types = [types] if isinstance(types, str) else list(types)
+        type_checks = [JSON_TYPES[t] for t in types if t in JSON_TYPES]
+        if type_checks:
+            def check_type(value, path):
+                if not any(check(value) for check in type_checks):
+                    return [f"{path}: expected {' or '.join(types)}, got {type(value).__name__}"]
+                return []
+            checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = schema["enum"]
+        checks.append(lambda value, path: [] if value in allowed else [f"{path}: must be one of {allowed}"])
+    if "const" in schema:
+        const = schema["const"]
+        checks.append(lambda value, path: [] if value == const else [f"{path}: must be {const!r}"])
+
+    bounds = [(key, schema[key]) for key in ("minimum", "maximum", "minLength", "maxLength", "minItems", "maxItems") if key in schema]
+    if bounds:
+        def check_bounds(value, path):
+            errors = []
+            for key, limit in bounds:
+                if key in ("minimum", "maximum"):
+                    if not JSON_TYPES["number"](value):
+                        continue
+                    measured = value
+                elif key in ("minLength", "maxLength"):
+                    if not isinstance(value, str):
+                        continue
+                    measured = len(value)
+                else:
+                    if not isinstance(value, list):
+                        continue
+                    measured = len(value)
+                if (key.startswith("min") and measured < limit) or (key.startswith("max") and measured > limit):
+                    errors.append(f"{path}: violates {key}={limit}")
+            return errors
+        checks.append(check_bounds)
+
+    if "pattern" in schema:
+        pattern = re.compile(schema["pattern"])
+        checks.append(lambda value, path: [] if not isinstance(value, str) or pattern.search(value) else [f"{path}: does not match {schema['pattern']}"])
+
+    properties = {name: compile_schema(sub) for name, sub in (schema.get("properties") or {}).items()}
+    required = list(schema.get("required") or [])
+    additional = schema.get("additionalProperties", True)
+    additional_check = compile_schema(additional) if isinstance(additional, dict) else None
+    if properties or required or additional is not True:
+        def check_object(value, path):
+            if not isinstance(value, dict):
+                return []
+            errors = [f"{path}.{name}: required property missing" for name in required if name not in value]
+            for name, item in value.items():
+                if name in properties:
+                    errors.extend(properties[name](item, f"{path}.{name}"))
+                elif additional is False:
+                    errors.append(f"{path}.{name}: unexpected property")
+                elif additional_check is not None:
+                    errors.extend(additional_check(item, f"{path}.{name}"))
+            return errors
+        checks.append(check_object)
+
+    if isinstance(schema.get("items"), dict):
+        item_check = compile_schema(schema["items"])
+        def check_items(value, path):
+            if not isinstance(value, list):
+                return []
+            errors = []
+            for i, item in enumerate(value):
+                errors.extend(item_check(item, f"{path}[{i}]"))
+            return errors
+        checks.append(check_items)
+
+    for keyword in ("anyOf", "oneOf"):
+        if isinstance(schema.get(keyword), list):
+            options = [compile_schema(sub) for sub in schema[keyword]]
+            def check_any(value, path, options=options, keyword=keyword):
+                if any(not option(value, path) for option in options):
+                    return []
+                return [f"{path}: does not match any allowed schema ({keyword})"]
+            checks.append(check_any)
+
+    def check(value, path):
+        errors = []
+        for c in checks:
+            errors.extend(c(value, path))
+        return errors
+    return check
+
+def tool(name, description, parameters=None):
+    # Marks an AIAgent method as a local tool
+    def decorate(method):
+        method.tool_spec = {
+            "name": name,
+            "description": description,
+            "parameters": parameters or {"type": "object", "properties": {}, "required": []}
+        }
+        return method
+    return decorate
+
+class RegisteredTool:
+
+    def __init__(self, name, description, parameters, handler, source):
+        self.name = name
+        self.schema = {
+            "type": "function",
+            "function": {"name": name, "description": description, "parameters": parameters}
+        }
+        self.handler = handler
+        self.source = source
+        self.validator = compile_schema(parameters)
+        signature = inspect.signature(handler).parameters
+        self.streams_output = "on_output" in signature
+        # argument names the handler takes, None when it takes **kwargs
+        takes_any = any(p.kind == p.VAR_KEYWORD for p in signature.values())
+        self.accepts = None if takes_any else set(signature) - {"on_output"}
+
+class ToolRegistry:
+
+    def __init__(self):
+        self.tools = {}
+
+    def register(self, name, description, parameters, handler, source="local"):
+        self.tools[name] = RegisteredTool(name, description, parameters, handler, source)
+
+    def register_methods(self, owner):
+        # Every @tool-decorated method of owner, in definition order
+        for attr, member in vars(type(owner)).items():
+            spec = getattr(member, "tool_spec", None)
+            if spec:
+                self.register(spec["name"], spec["description"], spec["parameters"], getattr(owner, attr))
+
+    def replace_source(self, source, tools):
+        # Swaps every tool of one source (e.g. the MCP catalog) in one assignment
+        kept = {name: t for name, t in self.tools.items() if t.source != source}
+        for registered in tools:
+            kept[registered.name] = registered
+        self.tools = kept
+
+    def get(self, name):
+        return self.tools.get(name)
+
+    def schemas(self, source=None):
+        return [t.schema for t in self.tools.values() if source is None or t.source == source]
+
+    def names(self, source=None):
+        return [name for name, t in self.tools.items() if source is None or t.source == source]
+
+    def validate(self, name, arguments):
+        registered = self.tools.get(name)
+        if registered is None:
+            return [f"unknown tool '{name}'"]
+        if not isinstance(arguments, dict):
+            return ["arguments must be a JSON object"]
+        errors = [error.replace("$.", "", 1) for error in registered.validator(arguments, "$")]
+        if registered.accepts is not None:
+            errors += [f"{name}: unexpected property" for name in arguments if name not in registered.accepts]
+        return errors
+
+    def dispatch(self, name, arguments, on_output=None):
+        registered = self.tools[name]
+        if registered.streams_output:
+            return registered.handler(**arguments, on_output=on_output)
+        return registered.handler(**arguments)
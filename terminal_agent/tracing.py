@@ -0,0 +1,141 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Span-style tracing for the agent loop, Docker execs and MCP calls. Spans nest
+# through a context variable, which asyncio tasks and asyncio.to_thread copy,
+# so tool calls running in worker threads still hang under their turn.
+# Finished spans go to an in-memory ring (for the live stats view) and, when
+# an export path is set, to a JSONL file.
+
+_current_span = contextvars.ContextVar("terminal_agent_span", default=None)
+
+class Span:
+
+    def __init__(self, name, trace_id, parent_id, attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def elapsed(self):
+        return time.perf_counter() - self._started
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+            "attrs": self.attrs
+        }
+
+class Tracer:
+
+    def __init__(self, max_spans=2000):
+        self.spans = deque(maxlen=max_spans)
+        self.enabled = True
+        self.export_path = None
+        self._lock = threading.Lock()
+        self._file = None
+
+    def configure(self, export_path=None, enabled=True):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.enabled = enabled
+            self.export_path = export_path
+            if export_path:
+                os.makedirs(os.path.dirname(os.path.abspath(export_path)), exist_ok=True)
+                self._file = open(export_path, "a", encoding="utf-8")
+
+    @contextmanager
+    def span(self, name, activate=True, **attrs):
+        # activate=False for spans held open across yields (generators), so
+        # that whatever the caller does meanwhile isn't parented to them
+        if not self.enabled:
+            yield Span(name, None, None, attrs)
+            return
+        parent = _current_span.get()
+        span = Span(name, parent.trace_id if parent else uuid.uuid4().hex[:16], parent.span_id if parent else None, attrs)
+        token = _current_span.set(span) if activate else None
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = span.elapsed()
+            if token is not None:
+                try:
+                    _current_span.reset(token)
+                except ValueError:
+                    # closed from another context (e.g. a generator finalized elsewhere)
+                    pass
+            self.finish(span)
+
+    def finish(self, span):
+        with self._lock:
+            self.spans.append(span)
+            if self._file is not None:
+                try:
+                    self._file.write(json.dumps(span.to_dict(), default=str) + "\n")
+                    self._file.flush()
+                except (OSError, ValueError) as e:
+                    logger.debug(f"Failed to export span {span.name}: {e}")
+
+    def stats(self):
+        # Per span name: count, errors, total / mean / p50 / p95 / max / last seconds,
+        # plus summed token counts where spans carry them
+        with self._lock:
+            spans = list(self.spans)
+        grouped = defaultdict(list)
+        for span in spans:
+            grouped[span.name].append(span)
+        stats = {}
+        for name, group in grouped.items():
+            durations = sorted(s.duration for s in group)
+            entry = {
+                "count": len(group),
+                "errors": sum(1 for s in group if s.error),
+                "total": sum(durations),
+                "mean": sum(durations) / len(durations),
+                "p50": durations[len(durations) // 2],
+                "p95": durations[min(int(len(durations) * 0.95), len(durations) - 1)],
+                "max": durations[-1],
+                "last": group[-1].duration
+            }
+            for key in ("prompt_tokens", "completion_tokens"):
+                values = [s.attrs[key] for s in group if isinstance(s.attrs.get(key), (int, float))]
+                if values:
+                    entry[key] = sum(values)
+            ttfts = sorted(s.attrs["ttft"] for s in group if isinstance(s.attrs.get("ttft"), (int, float)))
+            if ttfts:
+                entry["ttft_p50"] = ttfts[len(ttfts) // 2]
+            stats[name] = entry
+        return stats
+
+    def close(self):
+        self.configure(export_path=None, enabled=self.enabled)
+
+tracer = Tracer()
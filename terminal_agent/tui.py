@@ -1,34 +1,327 @@
+import asyncio
+import bisect
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
 from textual.app import App, ComposeResult
-from textual.containers import Horizontal, VerticalScroll
+from textual.containers import Horizontal
+from textual.geometry import Size
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
 from textual.widgets import Static, Header, Footer, Input
-from .dockerClient import DockerExecution
-from .agent import AIAgent
+from .tracing import tracer
+from .execScheduler import scheduler
+from rich.errors import MarkupError
 from rich.panel import Panel
+from rich.segment import Segment
+from rich.table import Table
 from rich.text import Text
 
-class TerminalPanel(VerticalScroll):
-    can_focus = True
-    async def add_message(self, text):
-        await self.mount(Static(text))
-        self.scroll_end(animate=False)
+logger = logging.getLogger(__name__)
+
+class ScrollbackEntry:
+    # One message of a panel. strips caches its rendered lines at the panel width;
+    # after a change the old strips stay (and stay consistent with the offsets)
+    # until the repaint timer rebuilds stale entries. Entries with a summary
+    # start collapsed and toggle on click.
+
+    def __init__(self, renderable, text=None, summary=None):
+        self.renderable = renderable
+        self.text = text
+        self.summary = summary
+        self.collapsed = summary is not None
+        self.strips = None
+        self.stale = False
+        self.removed = False
+
+    def visible(self):
+        return self.summary if self.collapsed else self.renderable
+
+    def transcript(self):
+        if self.text is not None:
+            return self.text
+        return self.renderable.plain if isinstance(self.renderable, Text) else str(self.renderable)
 
-class DockerPanel(VerticalScroll):
+class StreamingPanel(ScrollView):
+    # Scrollback drawn with the line API: only the rows in view are painted, and
+    # at most max_entries messages are kept. Older ones are spooled to a temp file
+    # so export_transcript still writes the whole session. Changes are applied
+    # in batches by a repaint timer instead of one layout per message.
     can_focus = True
-    async def add_message(self, text):
-        await self.mount(Static(text))
-        self.scroll_end(animate=False)
+    # Streamed text repaints at most this often
+    stream_interval = 0.05
+    max_entries = 500
+    # a live stream keeps only its last max_live_chars on screen
+    max_live_chars = 20000
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.entries = []
+        self.pending = []
+        self.offsets = []
+        self.total_lines = 0
+        self.render_width = 0
+        self.live = {}
+        self.dirty = False
+        self.spool = None
+
+    def on_mount(self):
+        self.set_interval(self.stream_interval, self.flush_streams)
+
+    def on_resize(self, event):
+        self.dirty = True
+
+    def to_renderable(self, text, markup=True):
+        if not isinstance(text, str):
+            return text
+        if markup:
+            try:
+                return Text.from_markup(text)
+            except MarkupError:
+                pass
+        return Text(text)
+
+    def add_entry(self, entry):
+        self.pending.append(entry)
+        self.dirty = True
+        return entry
+
+    async def add_message(self, text, markup=True):
+        renderable = self.to_renderable(text, markup)
+        self.add_entry(ScrollbackEntry(renderable))
+
+    async def stream_delta(self, delta, key, prefix="", style=None):
+        # One entry per stream key, updated in place by the repaint timer
+        if key not in self.live:
+            self.live[key] = self.add_entry(ScrollbackEntry(Text(prefix)))
+        entry = self.live[key]
+        entry.renderable.append(delta, style=style)
+        if len(entry.renderable) > self.max_live_chars:
+            kept = entry.renderable[len(entry.renderable) - self.max_live_chars:]
+            entry.renderable = Text(prefix + "...[earlier output trimmed]...\n") + kept
+        entry.stale = True
+        self.dirty = True
+
+    def flush_streams(self):
+        if not self.dirty:
+            return
+        width = self.scrollable_content_region.width
+        if width <= 0:
+            return
+        self.dirty = False
+        at_end = self.scroll_y >= self.max_scroll_y
+        if self.pending:
+            self.entries.extend(self.pending)
+            self.pending = []
+        self.entries = [entry for entry in self.entries if not entry.removed]
+        if len(self.entries) > self.max_entries:
+            evicted = self.entries[:len(self.entries) - self.max_entries]
+            self.entries = self.entries[len(evicted):]
+            self.spool_entries(evicted)
+        if width != self.render_width:
+            self.render_width = width
+            for entry in self.entries:
+                entry.stale = True
+        offsets = []
+        total = 0
+        for entry in self.entries:
+            if entry.strips is None or entry.stale:
+                entry.strips = self.render_strips(entry.visible(), width)
+                entry.stale = False
+            offsets.append(total)
+            total += len(entry.strips)
+        self.offsets = offsets
+        self.total_lines = total
+        self.virtual_size = Size(width, total)
+        self.refresh()
+        if at_end:
+            self.scroll_end(animate=False)
+
+    def render_strips(self, renderable, width):
+        console = self.app.console
+        segments = console.render(renderable, console.options.update_width(width))
+        return Strip.from_lines(list(Segment.split_lines(segments))) or [Strip.blank(width)]
+
+    def render_line(self, y):
+        scroll_x, scroll_y = self.scroll_offset
+        index = scroll_y + y
+        width = self.scrollable_content_region.width
+        if index >= self.total_lines:
+            return Strip.blank(width, self.rich_style)
+        position = bisect.bisect_right(self.offsets, index) - 1
+        strip = self.entries[position].strips[index - self.offsets[position]]
+        return strip.crop_extend(scroll_x, scroll_x + width, self.rich_style).apply_style(self.rich_style)
+
+    def entry_at(self, y):
+        index = self.scroll_offset.y + y
+        if not self.entries or index >= self.total_lines:
+            return None
+        return self.entries[bisect.bisect_right(self.offsets, index) - 1]
+
+    def on_click(self, event):
+        # Expands or collapses the summarized message under the pointer
+        offset = event.get_content_offset(self)
+        entry = self.entry_at(offset.y) if offset is not None else None
+        if entry is None or entry.summary is None:
+            return
+        entry.collapsed = not entry.collapsed
+        entry.stale = True
+        self.dirty = True
+        self.flush_streams()
+
+    async def end_stream(self, key, text=None, remove=False):
+        # Freezes a stream (optionally replacing its text) or removes its entry
+        if key not in self.live:
+            return False
+        entry = self.live.pop(key)
+        if remove:
+            entry.removed = True
+        elif text is not None:
+            entry.renderable = text
+            entry.stale = True
+        self.dirty = True
+        return True
+
+    async def end_all_streams(self):
+        for key in list(self.live):
+            await self.end_stream(key)
+
+    def spool_entries(self, entries):
+        if self.spool is None:
+            self.spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+        for entry in entries:
+            self.spool.write(entry.transcript() + "\n\n")
+
+    def export_transcript(self, f):
+        # Spooled (scrolled out) messages first, then what is still on screen
+        if self.spool is not None:
+            self.spool.flush()
+            self.spool.seek(0)
+            shutil.copyfileobj(self.spool, f)
+            self.spool.seek(0, os.SEEK_END)
+        for entry in self.entries + self.pending:
+            if not entry.removed:
+                f.write(entry.transcript() + "\n\n")
+
+class TerminalPanel(StreamingPanel):
+    async def stream_answer(self, delta):
+        await self.stream_delta(delta, "answer", prefix="Agent: ")
+
+    async def end_answer(self, text=None):
+        # Non-streamed answers (or none at all) get a regular message
+        if not await self.end_stream("answer", None if text is None else Text(f"Agent: {text}")):
+            if text is not None:
+                await self.add_message(f"Agent: {text}")
+
+class DockerPanel(StreamingPanel):
+    # Tool outputs longer than this show as a short preview until clicked
+    collapse_lines = 20
+    collapse_chars = 4000
+    preview_lines = 6
+
+    async def add_tool_output(self, tool, args, output):
+        content = f"Tool: {tool}\nArgs: {args}\n\n{output}"
+        panel = Panel(
+            Text(content, style="white"),
+            title="[bold magenta]TOOL OUTPUT[/bold magenta]",
+            border_style="magenta",
+            padding=(1, 2)
+        )
+        lines = content.splitlines()
+        summary = None
+        if len(lines) > self.collapse_lines or len(content) > self.collapse_chars:
+            preview = "\n".join(line[:200] for line in lines[:self.preview_lines])
+            summary = Panel(
+                Text.assemble(
+                    (preview, "white"),
+                    (f"\n\n... {len(lines) - self.preview_lines} more lines, {len(content)} chars (click to expand)", "dim")
+                ),
+                title="[bold magenta]TOOL OUTPUT[/bold magenta]",
+                border_style="magenta",
+                padding=(1, 2)
+            )
+        self.add_entry(ScrollbackEntry(panel, text=content, summary=summary))
+
+class StatsPanel(Static):
+    # Live per-stage timings from the tracer, hidden until toggled
+    refresh_interval = 1.0
+
+    def on_mount(self):
+        self.display = False
+        self.set_interval(self.refresh_interval, self.refresh_stats)
+
+    def refresh_stats(self):
+        if not self.display:
+            return
+        table = Table(title="Stage timings (s)", expand=True)
+        for column in ("stage", "count", "p50", "p95", "max", "last", "tokens in/out", "ttft p50"):
+            table.add_column(column, justify="left" if column == "stage" else "right")
+        for name, entry in sorted(tracer.stats().items()):
+            tokens = ""
+            if "prompt_tokens" in entry:
+                tokens = f"{entry['prompt_tokens']}/{entry.get('completion_tokens', 0)}"
+            table.add_row(
+                name + (f" ({entry['errors']} err)" if entry["errors"] else ""),
+                str(entry["count"]),
+                f"{entry['p50']:.3f}",
+                f"{entry['p95']:.3f}",
+                f"{entry['max']:.3f}",
+                f"{entry['last']:.3f}",
+                tokens,
+                f"{entry['ttft_p50']:.3f}" if "ttft_p50" in entry else ""
+            )
+        execs = scheduler.stats()
+        table.caption = (
+            f"exec slots {execs['running']}/{execs['max_concurrent']}, queued {execs['queued']}"
+            + (f", wait p50 {execs['wait_p50']:.3f}s p95 {execs['wait_p95']:.3f}s" if execs["wait_p50"] is not None else "")
+        )
+        self.update(table)
 
 class TerminalTUI(App):
     BINDINGS = [
         ("q", "quit", "Quit"),
         ("tab", "switch_panel", "Switch Panel"),
+        ("escape", "cancel_turn", "Cancel"),
+        ("f2", "toggle_stats", "Stats"),
+        ("ctrl+s", "export_transcript", "Save transcript"),
     ]
 
-    def __init__(self, **kwargs):
+    def __init__(self, refresh_tools=False, planner_mode="two_phase", pool_size=0, llm_cache=None, tool_top_k=8, backend=None, model=None,
+                 backend_factory=None, started_at=None, session=None, session_mode="image", run_cache=None, limits=None, **kwargs):
         super().__init__(**kwargs)
+        self.backend = backend
+        # builds the backend in the startup thread when no backend is passed in
+        self.backend_factory = backend_factory
+        self.model = model
+        self.tool_top_k = tool_top_k
+        self.llm_cache = llm_cache
+        self.refresh_tools = refresh_tools
+        self.planner_mode = planner_mode
+        self.pool_size = pool_size
+        self.sandbox_pool = None
         self.docker_mode = False
         self.docker_client = None
         self.agent = None
+        self.turn_worker = None
+        # a loaded session (see session.load_session) to resume, and how '/save' captures the sandbox
+        self.session = session
+        self.session_mode = session_mode
+        # a RunCache to memoize run_python_file, off unless passed in
+        self.run_cache = run_cache
+        # CPU / memory / pids quotas for the sandbox (dockerClient.resource_limits)
+        self.limits = limits
+        # Startup runs in the background once the UI is up; input typed before
+        # the agent is ready waits in pending_inputs
+        self.started_at = started_at or time.perf_counter()
+        self.startup_timings = {}
+        self.pending_inputs = []
+        self.ready = False
+        self.startup_failed = False
+        self.closing = False
+        self._startup_lock = threading.Lock()
         self.system_prompt = (
             "You are an AI terminal agent. You can call tools in succession to accomplish multi-step user requests in a Docker container. "
             "For each user request, decide if you should call a tool or respond with text. "
@@ -42,17 +335,171 @@ class TerminalTUI(App):
         with Horizontal():
             yield TerminalPanel(id="terminal_panel")
             yield DockerPanel(id="docker_panel")
+        yield StatsPanel(id="stats_panel")
         yield Input(placeholder="Type your command and press Enter...", id="input")
         yield Footer()
 
     async def on_mount(self):
         self.query_one("#terminal_panel").focus()
-        # Initialize Docker and agent
-        self.docker_client = DockerExecution()
-        self.docker_client.start_container()
-        self.agent = AIAgent(self.docker_client)
         await self.query_one("#terminal_panel", TerminalPanel).add_message("Welcome to Terminal Agent! Type your message below.")
         await self.query_one("#docker_panel", DockerPanel).add_message("Docker Container Output")
+        self.call_after_refresh(self.record_first_paint)
+        self.sub_title = "starting: sandbox, tools"
+        self.run_worker(self.initialize(), group="startup")
+
+    def record_first_paint(self):
+        self.startup_timings["first_paint"] = round(time.perf_counter() - self.started_at, 3)
+
+    def create_sandbox(self):
+        # Runs in a thread: may pull the image and wait for the container
+        from .dockerClient import DockerExecution
+        from .sandboxPool import SandboxPool
+        from .session import restore_sandbox
+        sandbox_pool = None
+        if self.session and self.session["mode"] == "image":
+            # the committed session image replaces the base image (and the pool)
+            docker_client = DockerExecution(image=self.session["image"], run_cache=self.run_cache, limits=self.limits, fresh=True)
+        else:
+            if self.pool_size:
+                sandbox_pool = SandboxPool(size=self.pool_size, limits=self.limits)
+                sandbox_pool.start()
+            # a resumed session must not inherit whatever the shared container holds now
+            docker_client = DockerExecution(pool=sandbox_pool, run_cache=self.run_cache, limits=self.limits,
+                                            fresh=self.session is not None)
+        docker_client.start_container()
+        if self.session:
+            restore_sandbox(self.session, docker_client)
+        with self._startup_lock:
+            if not self.closing:
+                self.sandbox_pool = sandbox_pool
+                self.docker_client = docker_client
+                return docker_client
+        # the app was quit while the sandbox was starting
+        docker_client.end_container(refill=False)
+        if sandbox_pool:
+            sandbox_pool.shutdown()
+        return None
+
+    def create_agent(self):
+        # Runs in a thread: builds the LLM client and loads or fetches the MCP tool catalog.
+        # The sandbox is attached once it is up.
+        from .agent import AIAgent
+        backend = self.backend or (self.backend_factory() if self.backend_factory else None)
+        agent = AIAgent(None, refresh_tools=self.refresh_tools, planner_mode=self.planner_mode, llm_cache=self.llm_cache, tool_top_k=self.tool_top_k, backend=backend, model=self.model)
+        if self.session:
+            agent.context.restore(self.session["conversation"])
+        with self._startup_lock:
+            if not self.closing:
+                self.agent = agent
+                return agent
+        agent.close()
+        return None
+
+    async def start_step(self, name, create):
+        started = time.perf_counter()
+        try:
+            with tracer.span(f"startup.{name}"):
+                return await asyncio.to_thread(create)
+        finally:
+            self.startup_timings[name] = round(time.perf_counter() - started, 3)
+            pending = [step for step in ("sandbox", "tools") if step not in self.startup_timings]
+            self.sub_title = f"starting: {', '.join(pending)}" if pending else ""
+
+    async def initialize(self):
+        terminal_panel = self.query_one("#terminal_panel", TerminalPanel)
+        docker_panel = self.query_one("#docker_panel", DockerPanel)
+        # a retry only runs the steps that failed
+        steps = {}
+        if self.docker_client is None:
+            steps["sandbox"] = self.create_sandbox
+        if self.agent is None:
+            steps["tools"] = self.create_agent
+        for name in steps:
+            self.startup_timings.pop(name, None)
+        self.startup_failed = False
+        with tracer.span("startup") as span:
+            results = await asyncio.gather(
+                *(self.start_step(name, create) for name, create in steps.items()),
+                return_exceptions=True
+            )
+            span.set(**self.startup_timings)
+        results = dict(zip(steps, results))
+        docker_client = results.get("sandbox", self.docker_client)
+        agent = results.get("tools", self.agent)
+        failed = False
+        if isinstance(docker_client, Exception):
+            logger.debug(f"Sandbox startup failed: {docker_client}")
+            await docker_panel.add_message(f"Sandbox failed to start: {docker_client}", markup=False)
+            failed = True
+        elif docker_client is not None and "sandbox" in steps:
+            await docker_panel.add_message(f"Sandbox ready ({self.startup_timings['sandbox']:.2f}s)")
+            if self.sandbox_pool:
+                stats = self.sandbox_pool.stats()
+                await docker_panel.add_message(
+                    f"Sandbox leased from pool of {stats['size']} (waited {stats['last_lease_wait']:.2f}s)"
+                )
+        if isinstance(agent, Exception):
+            logger.debug(f"Agent startup failed: {agent}")
+            await terminal_panel.add_message(f"Agent failed to start: {agent}", markup=False)
+            failed = True
+        if failed:
+            # nothing queued can run; input is refused until a /retry succeeds
+            self.startup_failed = True
+            self.sub_title = "startup failed"
+            if self.pending_inputs:
+                await terminal_panel.add_message(f"[dim]Dropped {len(self.pending_inputs)} queued input(s).[/dim]")
+                self.pending_inputs = []
+            await terminal_panel.add_message("[red]Startup failed. Type /retry to try again, or press q to quit.[/red]")
+            return
+        if docker_client is None or agent is None:
+            # the app is closing
+            return
+        agent.docker_client = docker_client
+        if self.session:
+            for message in agent.context.messages:
+                if message["role"] == "user":
+                    await terminal_panel.add_message(f"You: {message['content']}", markup=False)
+                elif "output_id" not in message:
+                    await terminal_panel.add_message(f"Agent: {message['content']}", markup=False)
+            await terminal_panel.add_message(
+                f"[dim]Resumed session {self.session['name']} ({len(agent.context.messages)} messages, {self.session['mode']})[/dim]"
+            )
+        self.startup_timings["interactive"] = round(time.perf_counter() - self.started_at, 3)
+        logger.debug(f"Startup timings: {self.startup_timings}")
+        await terminal_panel.add_message(
+            f"[dim]Ready in {self.startup_timings['interactive']:.2f}s "
+            f"(sandbox {self.startup_timings['sandbox']:.2f}s, {len(agent.mcp_tools)} MCP tools {self.startup_timings['tools']:.2f}s)[/dim]"
+        )
+        # replay what was typed during startup, one turn after the other
+        while self.pending_inputs:
+            await self.handle_input(self.pending_inputs.pop(0))
+            if self.turn_worker and self.turn_worker.is_running:
+                try:
+                    await self.turn_worker.wait()
+                except Exception as e:
+                    logger.debug(f"Queued turn ended early: {e}")
+        self.ready = True
+
+    async def on_unmount(self):
+        # a sandbox or agent still starting up is cleaned up by its startup thread
+        with self._startup_lock:
+            self.closing = True
+        if self.agent:
+            if self.agent.step_timings:
+                logger.debug(f"Planner latency summary: {self.agent.latency_summary()}")
+            if self.agent.llm_cache.enabled:
+                logger.debug(f"LLM cache stats: {self.agent.llm_cache.stats()}")
+            self.agent.close()
+            await self.agent.backend.close()
+        if self.run_cache:
+            logger.debug(f"Run cache stats: {self.run_cache.stats()}")
+        logger.debug(f"Exec scheduler stats: {scheduler.stats()}")
+        if self.docker_client:
+            # quitting: the pool is shut down next, so don't start a replacement sandbox
+            self.docker_client.end_container(refill=False)
+        if self.sandbox_pool:
+            logger.debug(f"Sandbox pool stats: {self.sandbox_pool.stats()}")
+            self.sandbox_pool.shutdown()
 
     def action_switch_panel(self):
         focused = self.focused
@@ -63,23 +510,48 @@ class TerminalTUI(App):
         next_panel = panels[1] if focused is panels[0] else panels[0]
         self.set_focus(next_panel)
 
-    def format_tool_output_panel(self, tool, args, output):
-        content = f"Tool: {tool}\nArgs: {args}\n\n{output}"
-        return Panel(
-            Text(str(content), style="white"),
-            title="[bold magenta]TOOL OUTPUT[/bold magenta]",
-            border_style="magenta",
-            padding=(1, 2)
-        )
+    def action_toggle_stats(self):
+        stats_panel = self.query_one("#stats_panel", StatsPanel)
+        stats_panel.display = not stats_panel.display
+        stats_panel.refresh_stats()
+
+    def action_cancel_turn(self):
+        if self.turn_worker and self.turn_worker.is_running:
+            self.turn_worker.cancel()
+
+    def action_export_transcript(self):
+        path = os.path.abspath(f"transcript-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("== Terminal ==\n\n")
+            self.query_one("#terminal_panel", TerminalPanel).export_transcript(f)
+            f.write("== Docker ==\n\n")
+            self.query_one("#docker_panel", DockerPanel).export_transcript(f)
+        self.notify(f"Transcript saved to {path}")
 
     async def on_input_submitted(self, event: Input.Submitted) -> None:
         user_input = event.value.strip()
         terminal_panel = self.query_one("#terminal_panel", TerminalPanel)
-        docker_panel = self.query_one("#docker_panel", DockerPanel)
         input_widget = self.query_one("#input", Input)
         input_widget.value = ""
         input_widget.focus()
+        if self.startup_failed:
+            if user_input == "/retry":
+                self.sub_title = "starting: retry"
+                await terminal_panel.add_message("[dim]Retrying startup...[/dim]")
+                self.run_worker(self.initialize(), group="startup")
+            elif user_input:
+                await terminal_panel.add_message("[red]The agent failed to start. Type /retry to try again.[/red]")
+            return
+        if not self.ready:
+            if user_input:
+                self.pending_inputs.append(user_input)
+                await terminal_panel.add_message(f"[dim]Queued until the agent is ready: {user_input}[/dim]")
+            return
+        await self.handle_input(user_input)
 
+    async def handle_input(self, user_input):
+        terminal_panel = self.query_one("#terminal_panel", TerminalPanel)
+        docker_panel = self.query_one("#docker_panel", DockerPanel)
         if user_input.lower() == "exit":
             if self.docker_mode:
                 self.docker_mode = False
@@ -88,6 +560,9 @@ class TerminalTUI(App):
             else:
                 await terminal_panel.add_message("[yellow]Goodbye! (Press q to quit)[/yellow]")
                 return
+        if user_input == "/save" or user_input.startswith("/save "):
+            await self.save_session(user_input[5:].strip())
+            return
         if user_input.lower() == "docker":
             self.docker_mode = True
             await terminal_panel.add_message(f"You: {user_input}")
@@ -95,21 +570,71 @@ class TerminalTUI(App):
             return
         if self.docker_mode and self.docker_client and self.docker_client.container:
             try:
-                exit_code, output = self.docker_client.container.exec_run(f"/bin/bash -c '{user_input}'")
-                result = output.decode('utf-8')
-                await docker_panel.add_message(f"$ {user_input}\n{result}")
+                result = await asyncio.to_thread(self.docker_client.run_shell_command, ["/bin/bash", "-c", user_input])
+                await docker_panel.add_message(f"$ {user_input}\n{result['output']}", markup=False)
                 await terminal_panel.add_message(f"You: {user_input}")
             except Exception as e:
-                await docker_panel.add_message(f"$ {user_input}\nError: {str(e)}")
+                await docker_panel.add_message(f"$ {user_input}\nError: {str(e)}", markup=False)
                 await terminal_panel.add_message(f"You: {user_input}")
         else:
+            if self.turn_worker and self.turn_worker.is_running:
+                await terminal_panel.add_message("[yellow]Agent is still working. Press Esc to cancel the current request.[/yellow]")
+                return
             await terminal_panel.add_message(f"You: {user_input}")
+            # Run the turn as a worker so the UI keeps handling input and repaints
+            self.turn_worker = self.run_worker(self.run_agent_turn(user_input), group="agent")
+
+    async def save_session(self, name):
+        from .session import save_session, default_session_name
+        terminal_panel = self.query_one("#terminal_panel", TerminalPanel)
+        if self.turn_worker and self.turn_worker.is_running:
+            await terminal_panel.add_message("[yellow]Wait for the current request to finish (or press Esc) before saving.[/yellow]")
+            return
+        name = name or default_session_name()
+        await terminal_panel.add_message(f"[dim]Saving session {name}...[/dim]")
+        try:
+            meta = await asyncio.to_thread(save_session, name, self.agent, self.docker_client, self.session_mode)
+        except Exception as e:
+            logger.debug(f"Saving session {name} failed: {e}")
+            await terminal_panel.add_message(f"Agent: Saving session failed: {e}", markup=False)
+            return
+        await terminal_panel.add_message(
+            f"Agent: Session saved as {name} ({meta['mode']}, {meta['seconds']:.2f}s). Resume with --resume {name}", markup=False
+        )
+
+    async def run_agent_turn(self, user_input):
+        terminal_panel = self.query_one("#terminal_panel", TerminalPanel)
+        docker_panel = self.query_one("#docker_panel", DockerPanel)
+        try:
             async for event in self.agent.process_input_stream(user_input):
-                if event["type"] == "tool":
-                    panel = self.format_tool_output_panel(event['tool'], event['args'], event['output'])
-                    await docker_panel.mount(Static(panel, markup=False))
+                if event["type"] == "exec_output":
+                    await docker_panel.stream_delta(
+                        event["data"], event["call_id"],
+                        prefix=f"$ {event['tool']}\n",
+                        style="red" if event["stream"] == "stderr" else None
+                    )
+                elif event["type"] == "tool":
+                    # any text streamed before the tool call stays as its own message
+                    await terminal_panel.end_answer()
+                    # the full output is in the tool panel, drop the live view
+                    await docker_panel.end_stream(event.get("call_id"), remove=True)
+                    await docker_panel.add_tool_output(event['tool'], event['args'], event['output'])
+                elif event["type"] == "text_delta":
+                    await terminal_panel.stream_answer(event["delta"])
                 elif event["type"] == "text":
-                    await terminal_panel.add_message(f"Agent: {event['response']}")
+                    await terminal_panel.end_answer(event["response"])
+        except asyncio.CancelledError:
+            await terminal_panel.end_all_streams()
+            await docker_panel.end_all_streams()
+            await terminal_panel.add_message("[yellow]Agent: Request cancelled.[/yellow]")
+            raise
+        except Exception as e:
+            # e.g. the LLM backend or the sandbox went away mid-turn; the app keeps running
+            logger.debug(f"Agent turn failed: {e}", exc_info=True)
+            await terminal_panel.end_all_streams()
+            await docker_panel.end_all_streams()
+            self.agent.add_message("assistant", f"[Turn failed: {type(e).__name__}: {e}]")
+            await terminal_panel.add_message(f"Agent: Request failed: {type(e).__name__}: {e}", markup=False)
 
 if __name__ == "__main__":
     TerminalTUI().run()
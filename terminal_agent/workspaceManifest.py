@@ -0,0 +1,149 @@
+import hashlib
+import json
+import time
+
+# Host-side manifest of the sandbox workspace: path -> size, mtime and sha256.
+# Writes made through DockerExecution are recorded directly, without an exec.
+# After a run the manifest is marked dirty and the next query does one scan
+# exec: SCAN_SCRIPT keeps the previous scan in a state file inside the
+# container, hashes only files whose size or mtime changed and prints just the
+# difference. Changes accumulate until take_changes() hands them out.
+
+SCAN_STATE_PATH = "/tmp/.terminal-agent-manifest.json"
+
+# argv: root, state file, max files, JSON list of top-level names to skip, and
+# "1" to ignore the state file (a new manifest needs every file, but the state
+# file survives restarts of the shared container and is committed in session images)
+SCAN_SCRIPT = r"""
+import hashlib, json, os, stat, sys
+root, state_path, max_files, skip = sys.argv[1], sys.argv[2], int(sys.argv[3]), set(json.loads(sys.argv[4]))
+try:
+    if sys.argv[5] == "1":
+        raise OSError("fresh scan")
+    with open(state_path) as f:
+        state = json.load(f)
+    full = False
+except (OSError, ValueError):
+    state, full = {}, True
+current, changed, truncated = {}, {}, False
+for dirpath, dirnames, filenames in os.walk(root):
+    if dirpath == root:
+        dirnames[:] = [d for d in dirnames if d not in skip]
+        filenames = [f for f in filenames if f not in skip]
+    dirnames[:] = sorted(d for d in dirnames if d != "__pycache__")
+    for name in sorted(filenames):
+        if len(current) >= max_files:
+            truncated = True
+            break
+        full_path = os.path.join(dirpath, name)
+        try:
+            st = os.lstat(full_path)
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode) or full_path == state_path:
+            continue
+        path = os.path.relpath(full_path, root)
+        old = state.get(path)
+        if old and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+            current[path] = old
+            continue
+        digest = hashlib.sha256()
+        try:
+            with open(full_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            digest = digest.hexdigest()
+        except OSError:
+            digest = None
+        current[path] = changed[path] = [st.st_size, st.st_mtime_ns, digest]
+    if truncated:
+        break
+removed = [] if truncated else [p for p in state if p not in current]
+with open(state_path, "w") as f:
+    json.dump(current, f)
+print(json.dumps({"full": full, "changed": changed, "removed": removed, "truncated": truncated}))
+"""
+
+def format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+class WorkspaceManifest:
+
+    def __init__(self, max_files=5000):
+        self.max_files = max_files
+        self.entries = {}
+        self.container_id = None
+        self.dirty = True
+        self.truncated = False
+        self.scans = 0
+        # path -> "added" | "modified" | "removed", since the last take_changes()
+        self.changes = {}
+
+    def needs_scan(self, container_id):
+        return self.dirty or container_id != self.container_id
+
+    def record(self, path, kind):
+        previous = self.changes.get(path)
+        if previous == "added" and kind == "removed":
+            del self.changes[path]
+        elif previous == "added":
+            return
+        elif previous == "removed" and kind == "added":
+            self.changes[path] = "modified"
+        else:
+            self.changes[path] = kind
+
+    def record_write(self, path, data):
+        # A write made through put_archive. The caller knows about it, so it is
+        # not reported as a change, and the next scan sees the same hash.
+        self.entries[path] = {"size": len(data), "mtime": time.time(), "hash": hashlib.sha256(data).hexdigest()}
+
+    def apply_scan(self, result, container_id):
+        # The first scan of a container is the baseline and reports no changes
+        baseline = container_id != self.container_id
+        if baseline:
+            self.entries = {}
+            self.changes = {}
+            self.container_id = container_id
+        for path, (size, mtime_ns, digest) in result["changed"].items():
+            old = self.entries.get(path)
+            self.entries[path] = {"size": size, "mtime": mtime_ns / 1e9, "hash": digest}
+            if not baseline and (old is None or old["hash"] != digest or digest is None):
+                self.record(path, "modified" if old else "added")
+        if result["full"] and not result["truncated"]:
+            # no state file in the container (e.g. /tmp was cleaned): everything unseen is gone
+            removed = [p for p in self.entries if p not in result["changed"]]
+        else:
+            removed = result["removed"]
+        for path in removed:
+            if self.entries.pop(path, None) is not None and not baseline:
+                self.record(path, "removed")
+        self.truncated = result["truncated"]
+        self.dirty = False
+        self.scans += 1
+
+    def take_changes(self):
+        changes = [
+            {"path": path, "change": kind, "size": self.entries[path]["size"] if path in self.entries else None}
+            for path, kind in sorted(self.changes.items())
+        ]
+        self.changes = {}
+        return changes
+
+    def listing(self):
+        return [{"path": path, **entry} for path, entry in sorted(self.entries.items())]
+
+def format_changes(changes):
+    # "+ out.csv (1.2 KB)", "~ main.py (300 B)", "- tmp.txt"
+    marks = {"added": "+", "modified": "~", "removed": "-"}
+    return [
+        f"{marks[c['change']]} {c['path']}" + (f" ({format_size(c['size'])})" if c["size"] is not None else "")
+        for c in changes
+    ]
+
+def scan_command(workdir, skip, max_files, fresh=False):
+    return ["python", "-c", SCAN_SCRIPT, workdir, SCAN_STATE_PATH, str(max_files), json.dumps(sorted(skip)), "1" if fresh else "0"]
@@ -0,0 +1,34 @@
+import pytest
+
+
+def docker_client():
+    # A live Docker daemon, or None (the sandbox tests are skipped then)
+    try:
+        import docker
+        client = docker.from_env()
+        client.ping()
+        return client
+    except Exception:
+        return None
+
+
+@pytest.fixture(scope="session")
+def docker_host():
+    client = docker_client()
+    if client is None:
+        pytest.skip("needs a running Docker daemon")
+    return client
+
+
+@pytest.fixture
+def sandbox(docker_host):
+    # A pooled sandbox, so tests never touch the fixed-name terminal-agent-container
+    from terminal_agent.dockerClient import DockerExecution
+    from terminal_agent.sandboxPool import SandboxPool
+    pool = SandboxPool(client=docker_host, size=1)
+    pool.start()
+    docker_client = DockerExecution(pool=pool)
+    docker_client.start_container()
+    yield docker_client
+    docker_client.end_container(refill=False)
+    pool.shutdown()
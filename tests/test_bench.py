@@ -0,0 +1,26 @@
+import asyncio
+
+import pytest
+
+from terminal_agent.bench import DEFAULT_TASKS, FakeContainer, run_task
+
+TASKS = {task["id"]: task for task in DEFAULT_TASKS}
+
+
+@pytest.mark.parametrize("planner_mode, task_id, tool_calls", [
+    ("fused", "answer", 0),
+    ("fused", "list_files", 1),
+    ("fused", "create_and_run", 2),
+    ("fused", "install_parallel", 4),
+    ("two_phase", "answer", 0),
+    ("two_phase", "list_files", 1),
+    ("two_phase", "create_and_run", 2),
+    # stops at the loop limit, which repeats the last output without a call_id
+    ("two_phase", "install_parallel", 3),
+])
+def test_run_task_counts_each_tool_call_once(planner_mode, task_id, tool_calls):
+    container = FakeContainer(run_latency=0, install_latency=0)
+    result = asyncio.run(run_task(TASKS[task_id], planner_mode, container))
+    assert result["error"] is None
+    assert result["unused_replies"] == 0
+    assert result["tool_calls"] == tool_calls
@@ -0,0 +1,12 @@
+def test_run_file_keeps_output_printed_before_a_timeout(sandbox):
+    sandbox.write_file("loop.py", "import time\nprint('starting')\nwhile True:\n    time.sleep(1)\n")
+    result = sandbox.run_file("loop.py", timeout=3)
+    assert result["timed_out"]
+    assert "starting" in result["output"]
+
+
+def test_run_file_streams_output_before_the_script_exits(sandbox):
+    sandbox.write_file("slow.py", "import time\nprint('first')\ntime.sleep(2)\nprint('second')\n")
+    seen = []
+    sandbox.run_file("slow.py", on_output=lambda stream, text: seen.append(text))
+    assert "first" in seen[0] and "second" not in seen[0]
@@ -0,0 +1,32 @@
+import threading
+from collections import deque
+
+import pytest
+
+from terminal_agent import execScheduler
+from terminal_agent.execScheduler import ExecScheduler
+
+
+def test_cancelled_ticket_leaves_the_others_queued():
+    scheduler = ExecScheduler(max_concurrent=1)
+    first, second = {"kind": "run", "granted": False}, {"kind": "run", "granted": False}
+    scheduler.queues["sandbox"] = deque([first, second])
+    scheduler._remove("sandbox", second)
+    assert list(scheduler.queues["sandbox"]) == [first]
+    assert scheduler.queues["sandbox"][0] is first
+
+
+@pytest.mark.skipif(execScheduler.fcntl is None, reason="host-wide slots need fcntl")
+def test_slots_are_shared_between_schedulers(tmp_path):
+    # two schedulers stand in for two agent processes on one host
+    first = ExecScheduler(max_concurrent=1, lock_dir=str(tmp_path))
+    second = ExecScheduler(max_concurrent=1, lock_dir=str(tmp_path))
+    cancel = threading.Event()
+    with first.slot("a", "run") as granted:
+        assert granted
+        threading.Timer(0.3, cancel.set).start()
+        with second.slot("b", "run", cancel_event=cancel) as blocked:
+            assert blocked is False
+    assert second.stats()["running"] == 0
+    with second.slot("b", "run") as granted:
+        assert granted
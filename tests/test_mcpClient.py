@@ -0,0 +1,13 @@
+from terminal_agent import mcpClient
+
+
+def test_catalog_saved_under_the_digest_once_the_image_is_pulled(tmp_path, monkeypatch):
+    digests = iter([None, "sha256:abc"])
+    monkeypatch.setattr(mcpClient, "image_digest", lambda image: next(digests))
+    cache = mcpClient.ToolCatalogCache(path=str(tmp_path / "mcp_tools.json"))
+    # image not pulled yet: nothing cached, and the fallback isn't kept
+    assert cache.load() == (None, True)
+    cache.save([{"function": {"name": "get_me"}}])
+    tools, stale = cache.load()
+    assert cache.digest == "sha256:abc"
+    assert tools == [{"function": {"name": "get_me"}}] and not stale
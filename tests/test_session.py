@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+from terminal_agent.context import ContextManager
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    from terminal_agent import session
+    saved = []
+    yield session, saved
+    for name in saved:
+        session.delete_session(name)
+
+
+@pytest.fixture
+def fixed_container(docker_host):
+    # the shared terminal-agent-container the resumed sandboxes use
+    yield
+    try:
+        docker_host.containers.get("terminal-agent-container").remove(force=True)
+    except Exception:
+        pass
+
+
+def agent():
+    return SimpleNamespace(planner_mode="two_phase", context=ContextManager())
+
+
+def resume(session, name, docker_host, pool=None):
+    from terminal_agent.dockerClient import DockerExecution
+    meta = session.load_session(name)
+    if meta["mode"] == "image":
+        docker_client = DockerExecution(image=meta["image"], fresh=True)
+    else:
+        docker_client = DockerExecution(pool=pool, fresh=True)
+    docker_client.start_container()
+    session.restore_sandbox(meta, docker_client)
+    return docker_client
+
+
+def test_image_resume_replaces_a_running_container(sandbox, sessions, docker_host, fixed_container):
+    session, saved = sessions
+    sandbox.write_file("saved.txt", "saved")
+    session.save_session("image-resume", agent(), sandbox, mode="image")
+    saved.append("image-resume")
+
+    first = resume(session, "image-resume", docker_host)
+    first.write_file("later.txt", "written after the save")
+    # the same session image is still running in the fixed-name container
+    second = resume(session, "image-resume", docker_host)
+    assert second.container.id != first.container.id
+    assert second.read_files(["saved.txt", "later.txt"]) == {"saved.txt": "saved", "later.txt": None}
+
+
+@pytest.mark.parametrize("resume_pooled", [False, True])
+def test_tarball_resume_from_a_pooled_sandbox(sandbox, sessions, docker_host, fixed_container, resume_pooled):
+    from terminal_agent.sandboxPool import SandboxPool
+    session, saved = sessions
+    sandbox.write_file("saved.txt", "saved")
+    session.save_session("tarball-resume", agent(), sandbox, mode="tarball")
+    saved.append("tarball-resume")
+
+    pool = None
+    if resume_pooled:
+        pool = SandboxPool(client=docker_host, size=1)
+        pool.start()
+    else:
+        # leave a stale file in the shared container
+        stale = resume(session, "tarball-resume", docker_host)
+        stale.write_file("stale.txt", "from an earlier resume")
+    try:
+        docker_client = resume(session, "tarball-resume", docker_host, pool=pool)
+        assert docker_client.workdir == sandbox.workdir
+        assert docker_client.read_files(["saved.txt", "stale.txt"]) == {"saved.txt": "saved", "stale.txt": None}
+        docker_client.end_container(refill=False)
+    finally:
+        if pool is not None:
+            pool.shutdown()